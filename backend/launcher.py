@@ -0,0 +1,125 @@
+"""Production launcher: a supervised pool of uvicorn workers, a single process, or a reloading dev server
+
+Run it with `python server.py` (or `python launcher.py`); `python server.py migrate-gridfs` and
+`python server.py backfill-derivatives` run the maintenance commands instead.
+"""
+import multiprocessing
+import os
+import shutil
+import signal
+import tempfile
+import threading
+
+from metrics import remove_worker_metrics
+from server import app
+
+SERVER_HOST = os.environ.get('SERVER_HOST', '0.0.0.0')
+SERVER_PORT = int(os.environ.get('SERVER_PORT', 8001))
+# Worker processes. Each worker has its own caches, LLM admission limits (LLM_MAX_CONCURRENCY,
+# LLM_QUEUE_SIZE) and chat token buckets, so with N workers those limits allow up to N times as
+# much in total; gallery caches follow other workers' writes via CACHE_SYNC_INTERVAL
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', 1))
+GRACEFUL_TIMEOUT = float(os.environ.get('GRACEFUL_TIMEOUT', 30))
+# Proxies whose X-Forwarded-For sets the client address; chat rate limiting keys on it only when
+# it came from one of these. "*" trusts any peer
+FORWARDED_ALLOW_IPS = os.environ.get('FORWARDED_ALLOW_IPS', '127.0.0.1')
+SERVER_RELOAD = os.environ.get('SERVER_RELOAD', '0').lower() in ('1', 'true', 'yes')
+
+def run_worker(sockets):
+    """Worker process entry: serve the app on the socket the supervisor bound"""
+    import uvicorn
+
+    config = uvicorn.Config(
+        app, host=SERVER_HOST, port=SERVER_PORT, timeout_graceful_shutdown=GRACEFUL_TIMEOUT,
+        proxy_headers=True, forwarded_allow_ips=FORWARDED_ALLOW_IPS,
+    )
+    uvicorn.Server(config).run(sockets=sockets)
+
+class WorkerSupervisor:
+    """Runs N spawned workers on one listening socket; SIGHUP rolls them, SIGTERM/SIGINT drains them"""
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.processes = []
+        self.should_exit = threading.Event()
+        self.should_reload = threading.Event()
+
+    def spawn(self, sockets):
+        process = multiprocessing.get_context("spawn").Process(target=run_worker, args=(sockets,), name="api-worker")
+        process.start()
+        return process
+
+    def stop(self, processes):
+        # SIGTERM makes uvicorn stop accepting and finish in-flight requests within GRACEFUL_TIMEOUT
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join(GRACEFUL_TIMEOUT + 5)
+            if process.is_alive():
+                process.kill()
+                process.join()
+
+    def run(self):
+        import uvicorn
+
+        sock = uvicorn.Config(app, host=SERVER_HOST, port=SERVER_PORT).bind_socket()
+        signal.signal(signal.SIGINT, lambda *_: self.should_exit.set())
+        signal.signal(signal.SIGTERM, lambda *_: self.should_exit.set())
+        if hasattr(signal, "SIGHUP"):
+            signal.signal(signal.SIGHUP, lambda *_: self.should_reload.set())
+        metrics_dir = os.environ.get('METRICS_MULTIPROC_DIR')
+        if metrics_dir:
+            remove_worker_metrics(metrics_dir)
+        print(f"Supervisor {os.getpid()} starting {self.workers} worker(s) on {SERVER_HOST}:{SERVER_PORT}")
+        self.processes = [self.spawn([sock]) for _ in range(self.workers)]
+        while not self.should_exit.wait(0.5):
+            if self.should_reload.is_set():
+                self.should_reload.clear()
+                print("Reloading workers one at a time")
+                for index, old in enumerate(list(self.processes)):
+                    # Start the replacement before draining the old worker so capacity never drops by more than one
+                    self.processes[index] = self.spawn([sock])
+                    self.stop([old])
+            for index, process in enumerate(self.processes):
+                if not process.is_alive() and not self.should_exit.is_set():
+                    print(f"Worker {process.pid} exited with code {process.exitcode}, restarting")
+                    if metrics_dir:
+                        remove_worker_metrics(metrics_dir, process.pid)
+                    self.processes[index] = self.spawn([sock])
+        print(f"Stopping {len(self.processes)} worker(s)")
+        self.stop(self.processes)
+        sock.close()
+        if metrics_dir:
+            remove_worker_metrics(metrics_dir)
+
+def serve():
+    """Run the API: a supervised worker pool, a single process, or a code-reloading dev server"""
+    import uvicorn
+
+    if SERVER_RELOAD:
+        uvicorn.run(
+            "server:app", host=SERVER_HOST, port=SERVER_PORT, reload=True,
+            app_dir=os.path.dirname(os.path.abspath(__file__)),
+            proxy_headers=True, forwarded_allow_ips=FORWARDED_ALLOW_IPS,
+        )
+    elif WEB_CONCURRENCY == 1:
+        uvicorn.run(
+            app, host=SERVER_HOST, port=SERVER_PORT, timeout_graceful_shutdown=GRACEFUL_TIMEOUT,
+            proxy_headers=True, forwarded_allow_ips=FORWARDED_ALLOW_IPS,
+        )
+    else:
+        # Split the derivative process pool across workers instead of giving each one every core
+        os.environ.setdefault('DERIVATIVE_WORKERS', str(max(1, (os.cpu_count() or 1) // WEB_CONCURRENCY)))
+        # A worker's cached history misses turns another worker answered; read sessions from Mongo
+        os.environ.setdefault('SESSION_CACHE_ENTRIES', '0')
+        created_metrics_dir = not os.environ.get('METRICS_MULTIPROC_DIR')
+        if created_metrics_dir:
+            os.environ['METRICS_MULTIPROC_DIR'] = tempfile.mkdtemp(prefix="api-metrics-")
+        try:
+            WorkerSupervisor(WEB_CONCURRENCY).run()
+        finally:
+            if created_metrics_dir:
+                shutil.rmtree(os.environ['METRICS_MULTIPROC_DIR'], ignore_errors=True)
+
+if __name__ == "__main__":
+    serve()
@@ -0,0 +1,288 @@
+"""Prometheus-style metrics, the sampling profiler and startup timings for the API workers
+
+Each worker keeps its own series in memory. When the launcher runs several workers it sets
+METRICS_MULTIPROC_DIR; every worker then exports its series to a file there and a scrape merges
+all of them with a worker label.
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from typing import Callable, List, Optional
+
+from pymongo import monitoring
+
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1').lower() in ('1', 'true', 'yes')
+PROFILER_SAMPLE_INTERVAL = float(os.environ.get('PROFILER_SAMPLE_INTERVAL', 0))
+# Set by the launcher when it runs several workers: each one exports its metrics to a file here
+# every METRICS_FLUSH_INTERVAL seconds, and whichever worker answers a scrape merges them all
+METRICS_MULTIPROC_DIR = os.environ.get('METRICS_MULTIPROC_DIR', '')
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+class Counter:
+    """Labelled Prometheus counter; safe to update from Motor's worker threads"""
+
+    def __init__(self, name: str, help_text: str, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(label, "")) for label in self.labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{format_labels(self.labels, key)} {value}")
+        return lines
+
+class Histogram:
+    """Labelled Prometheus histogram with fixed upper bounds"""
+
+    def __init__(self, name: str, help_text: str, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(label, "")) for label in self.labels)
+        with self._lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{format_labels(self.labels + ('le',), key + (repr(float(bound)),))} {cumulative}")
+            lines.append(f"{self.name}_bucket{format_labels(self.labels + ('le',), key + ('+Inf',))} {count}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, key)} {total}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, key)} {count}")
+        return lines
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(
+        f'{name}="{value.replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+        for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+HTTP_REQUEST_SECONDS = Histogram("http_request_duration_seconds", "HTTP request latency by route", ("method", "route", "status"))
+HTTP_RESPONSE_BYTES = Histogram("http_response_size_bytes", "HTTP response body size by route", ("method", "route"), SIZE_BUCKETS)
+HTTP_REQUEST_BYTES = Histogram("http_request_size_bytes", "HTTP request body size by route", ("method", "route"), SIZE_BUCKETS)
+MONGO_COMMAND_SECONDS = Histogram("mongo_command_duration_seconds", "MongoDB command latency", ("command", "collection", "outcome"))
+OPENAI_REQUEST_SECONDS = Histogram("openai_request_duration_seconds", "OpenAI completion latency", ("mode", "outcome"))
+CHAT_RESPONSES = Counter("chat_responses_total", "Chat answers by source", ("source",))
+CHAT_FALLBACKS = Counter("chat_fallback_total", "Chat answers served by the keyword fallback", ("reason",))
+GALLERY_SERIALIZE_SECONDS = Histogram("gallery_serialize_duration_seconds", "Gallery page serialization time")
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Times every command the driver sends, including GridFS chunk reads and writes"""
+
+    def __init__(self):
+        self._pending = {}
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            collection = ""
+        self._pending[(event.connection_id, event.request_id)] = collection
+
+    def _finish(self, event, outcome):
+        collection = self._pending.pop((event.connection_id, event.request_id), "")
+        MONGO_COMMAND_SECONDS.observe(
+            event.duration_micros / 1e6, command=event.command_name, collection=collection, outcome=outcome
+        )
+
+    def succeeded(self, event):
+        self._finish(event, "ok")
+
+    def failed(self, event):
+        self._finish(event, "error")
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency, status and payload sizes per route template"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        state = {"status": 500, "bytes": 0}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                state["bytes"] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # Label by route template, not raw path, to keep cardinality bounded
+            route = scope.get("route")
+            route_path = getattr(route, "path", "unmatched")
+            method = scope["method"]
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, method=method, route=route_path, status=state["status"])
+            HTTP_RESPONSE_BYTES.observe(state["bytes"], method=method, route=route_path)
+            for name, value in scope.get("headers", []):
+                if name == b"content-length" and value.isdigit():
+                    HTTP_REQUEST_BYTES.observe(int(value), method=method, route=route_path)
+                    break
+
+class StackSampler:
+    """Opt-in sampling profiler: periodically records the event loop thread's stack"""
+
+    def __init__(self):
+        self.samples = {}
+        self.total = 0
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self, target_thread_id: int, interval: float):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, args=(target_thread_id, interval), name="stack-sampler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join(timeout=1)
+            self._thread = None
+
+    def _run(self, target_thread_id: int, interval: float):
+        while not self._stop.wait(interval):
+            frame = sys._current_frames().get(target_thread_id)
+            if frame is None:
+                continue
+            # Collapsed-stack format: outermost;...;innermost
+            stack = ";".join(
+                f"{os.path.basename(entry.filename)}:{entry.name}:{entry.lineno}"
+                for entry in traceback.extract_stack(frame)
+            )
+            self.samples[stack] = self.samples.get(stack, 0) + 1
+            self.total += 1
+
+    def top(self, limit: int):
+        hottest = sorted(self.samples.items(), key=lambda item: item[1], reverse=True)[:limit]
+        return [{"samples": count, "share": round(count / self.total, 4), "stack": stack} for stack, count in hottest]
+
+    def reset(self):
+        self.samples = {}
+        self.total = 0
+
+stack_sampler = StackSampler()
+
+# Per-worker startup timings (seconds), reported once the lifespan startup completes
+startup_timings = {}
+
+@contextmanager
+def startup_phase(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_timings[name] = time.perf_counter() - started
+
+def report_startup():
+    phases = ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in startup_timings.items())
+    total = sum(startup_timings.values())
+    print(f"Worker {os.getpid()} ready in {total * 1000:.0f} ms ({phases})")
+
+def startup_metric_lines():
+    lines = ["# HELP process_startup_seconds Time spent in each startup phase of this worker",
+             "# TYPE process_startup_seconds gauge"]
+    lines += [f'process_startup_seconds{{phase="{name}"}} {seconds}' for name, seconds in startup_timings.items()]
+    return lines
+
+# Multi-worker export
+def write_worker_metrics(directory: str, lines: List[str]):
+    """Export this worker's metrics for whichever worker answers the next scrape"""
+    path = os.path.join(directory, f"{os.getpid()}.prom")
+    with open(path + ".tmp", "w") as handle:
+        handle.write("\n".join(lines) + "\n")
+    os.replace(path + ".tmp", path)
+
+def remove_worker_metrics(directory: str, pid: Optional[int] = None):
+    """Forget one worker's exported metrics, or every worker's when `pid` is None"""
+    names = [f"{pid}.prom"] if pid is not None else [name for name in os.listdir(directory) if name.endswith(".prom")]
+    for name in names:
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass
+
+def merged_metric_lines(directory: str):
+    """Every worker's exported metrics as one exposition, each series labelled with its worker pid"""
+    families = {}
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(".prom"):
+            continue
+        worker = name[:-len(".prom")]
+        try:
+            with open(os.path.join(directory, name)) as handle:
+                text = handle.read()
+        except FileNotFoundError:
+            continue  # the worker exited after listdir
+        family = None
+        for line in text.splitlines():
+            if line.startswith("#"):
+                family = families.setdefault(line.split()[2], [])
+                if line not in family:
+                    family.append(line)
+            elif line and family is not None:
+                series, _, value = line.rpartition(" ")
+                if series.endswith("}"):
+                    series = f'{series[:-1]},worker="{worker}"}}'
+                else:
+                    series = f'{series}{{worker="{worker}"}}'
+                family.append(f"{series} {value}")
+    return [line for family in families.values() for line in family]
+
+async def flush_worker_metrics(directory: str, collect: Callable[[], List[str]]):
+    """Re-export `collect()` every METRICS_FLUSH_INTERVAL seconds until cancelled"""
+    while True:
+        try:
+            write_worker_metrics(directory, collect())
+        except OSError as e:
+            print(f"Metrics export error: {str(e)}")
+        await asyncio.sleep(METRICS_FLUSH_INTERVAL)
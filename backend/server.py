@@ -1,21 +1,112 @@
-from fastapi import FastAPI, HTTPException, Depends, File, UploadFile, Form
+import time
+IMPORT_STARTED = time.perf_counter()
+
+from fastapi import FastAPI, HTTPException, Depends, File, UploadFile, Form, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, ORJSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel
 from typing import List, Optional
 import os
-from motor.motor_asyncio import AsyncIOMotorClient
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
 import uuid
 from datetime import datetime
 import json
 import base64
-from passlib.context import CryptContext
+import mimetypes
+import asyncio
+import io
+import hashlib
+import re
+import functools
+import gzip
+import multiprocessing
+import sys
+import tempfile
+import threading
+import unicodedata
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from concurrent.futures import ProcessPoolExecutor
+import gridfs
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 import jwt
 from datetime import timedelta
-import openai
+
+from metrics import (
+    CHAT_FALLBACKS,
+    CHAT_RESPONSES,
+    GALLERY_SERIALIZE_SECONDS,
+    HTTP_REQUEST_BYTES,
+    HTTP_REQUEST_SECONDS,
+    HTTP_RESPONSE_BYTES,
+    METRICS_ENABLED,
+    METRICS_MULTIPROC_DIR,
+    MONGO_COMMAND_SECONDS,
+    OPENAI_REQUEST_SECONDS,
+    PROFILER_SAMPLE_INTERVAL,
+    MetricsMiddleware,
+    MongoCommandMetrics,
+    flush_worker_metrics,
+    merged_metric_lines,
+    remove_worker_metrics,
+    report_startup,
+    stack_sampler,
+    startup_metric_lines,
+    startup_phase,
+    startup_timings,
+    write_worker_metrics,
+)
+
+# Optional fast paths: orjson for JSON, brotli and zstandard for response compression
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create per-worker resources on startup and release them on shutdown"""
+    with startup_phase("mongo"):
+        connect_mongo()
+    with startup_phase("indexes"):
+        await ensure_indexes()
+    with startup_phase("openai"):
+        start_openai_client()
+    with startup_phase("derivatives"):
+        start_derivative_pool()
+    report_startup()
+    if PROFILER_SAMPLE_INTERVAL > 0:
+        stack_sampler.start(threading.get_ident(), PROFILER_SAMPLE_INTERVAL)
+    metrics_exporter = None
+    if METRICS_ENABLED and METRICS_MULTIPROC_DIR:
+        metrics_exporter = asyncio.create_task(flush_worker_metrics(METRICS_MULTIPROC_DIR, worker_metric_lines))
+    try:
+        yield
+    finally:
+        if metrics_exporter is not None:
+            metrics_exporter.cancel()
+            remove_worker_metrics(METRICS_MULTIPROC_DIR, os.getpid())
+        stack_sampler.stop()
+        await close_openai_client()
+        shutdown_derivative_pool()
+        close_mongo()
 
 # Initialize FastAPI app
-app = FastAPI(title="Femina Beauty Impression API")
+app = FastAPI(
+    title="Femina Beauty Impression API",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse if orjson is not None else JSONResponse,
+)
 
 # CORS middleware
 app.add_middleware(
@@ -24,27 +115,119 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
 # Security
 security = HTTPBearer()
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 SECRET_KEY = "your-secret-key-here"
 ALGORITHM = "HS256"
 
-# MongoDB connection
+# MongoDB connection (created per worker in lifespan, see connect_mongo)
 MONGO_URL = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
-client = AsyncIOMotorClient(MONGO_URL)
-db = client.beauty_salon
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', 100))
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', 0))
+MONGO_MAX_IDLE_TIME_MS = int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', 60000))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000))
+MONGO_CONNECT_TIMEOUT_MS = int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', 5000))
+MONGO_SOCKET_TIMEOUT_MS = int(os.environ.get('MONGO_SOCKET_TIMEOUT_MS', 20000))
+MONGO_COMPRESSORS = os.environ.get('MONGO_COMPRESSORS', 'zlib')
+HEALTH_PING_TIMEOUT = float(os.environ.get('HEALTH_PING_TIMEOUT', 2))
+client = None
+db = None
+
+# GridFS storage for gallery image bytes
+GALLERY_BUCKET = os.environ.get('GALLERY_BUCKET', 'gallery_images')
+UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', 256 * 1024))
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', 20 * 1024 * 1024))
+gallery_fs = None
+
+# Bulk uploads
+BATCH_MAX_FILES = int(os.environ.get('BATCH_MAX_FILES', 50))
+BATCH_MAX_BYTES = int(os.environ.get('BATCH_MAX_BYTES', 200 * 1024 * 1024))
+BATCH_UPLOAD_CONCURRENCY = int(os.environ.get('BATCH_UPLOAD_CONCURRENCY', 4))
+
+# Gallery listing
+GALLERY_PAGE_SIZE = int(os.environ.get('GALLERY_PAGE_SIZE', 24))
+GALLERY_MAX_PAGE_SIZE = int(os.environ.get('GALLERY_MAX_PAGE_SIZE', 100))
+# Listings carry metadata only; image bytes are fetched from the raw URL
+GALLERY_LIST_PROJECTION = {"_id": 0, "image_data": 0, "file_id": 0, "derivatives.file_id": 0}
+
+# Responsive derivatives (resized copies generated once per upload)
+DERIVATIVE_WIDTHS = [int(w) for w in os.environ.get('DERIVATIVE_WIDTHS', '320,800,1600').split(',') if w.strip()]
+DERIVATIVE_FORMAT = os.environ.get('DERIVATIVE_FORMAT', 'WEBP').upper()
+DERIVATIVE_QUALITY = int(os.environ.get('DERIVATIVE_QUALITY', 82))
+DERIVATIVE_WORKERS = int(os.environ.get('DERIVATIVE_WORKERS', 0)) or None
+derivative_pool = None
+
+# In-process gallery caches
+GALLERY_CACHE_ENTRIES = int(os.environ.get('GALLERY_CACHE_ENTRIES', 64))
+GALLERY_CACHE_TTL = float(os.environ.get('GALLERY_CACHE_TTL', 30))
+GALLERY_CACHE_CONTROL = os.environ.get('GALLERY_CACHE_CONTROL', 'public, max-age=0, must-revalidate')
+IMAGE_CACHE_MAX_BYTES = int(os.environ.get('IMAGE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+IMAGE_CACHE_MAX_ITEM_BYTES = int(os.environ.get('IMAGE_CACHE_MAX_ITEM_BYTES', 2 * 1024 * 1024))
+IMAGE_CACHE_CONTROL = os.environ.get('IMAGE_CACHE_CONTROL', 'public, max-age=86400')
+# Upper bound on how long a worker can serve bytes of an image another process deleted
+IMAGE_CACHE_TTL = float(os.environ.get('IMAGE_CACHE_TTL', 300))
+# Seconds between checks of the shared gallery version bumped by other workers and CLI commands
+# (0 checks on every request, a negative value turns the check off)
+CACHE_SYNC_INTERVAL = float(os.environ.get('CACHE_SYNC_INTERVAL', 1))
+IMAGE_SECURITY_HEADERS = {"X-Content-Type-Options": "nosniff"}
+# Content-addressed images never change under their digest-versioned URLs
+IMMUTABLE_CACHE_CONTROL = os.environ.get('IMMUTABLE_CACHE_CONTROL', 'public, max-age=31536000, immutable')
 
 # OpenAI configuration
-openai.api_key = os.environ.get('OPENAI_API_KEY')
+OPENAI_MODEL = os.environ.get('OPENAI_MODEL', 'gpt-3.5-turbo')
+OPENAI_TIMEOUT = float(os.environ.get('OPENAI_TIMEOUT', 10))
+OPENAI_CONNECT_TIMEOUT = float(os.environ.get('OPENAI_CONNECT_TIMEOUT', 3))
+OPENAI_MAX_RETRIES = int(os.environ.get('OPENAI_MAX_RETRIES', 2))
+OPENAI_DEADLINE = float(os.environ.get('OPENAI_DEADLINE', 15))
+OPENAI_MAX_CONNECTIONS = int(os.environ.get('OPENAI_MAX_CONNECTIONS', 20))
+# Shared AsyncOpenAI client, created on startup when an API key is configured
+openai_client = None
+
+# Answer cache for repeated chat questions
+ANSWER_CACHE_ENTRIES = int(os.environ.get('ANSWER_CACHE_ENTRIES', 512))
+ANSWER_CACHE_TTL = float(os.environ.get('ANSWER_CACHE_TTL', 6 * 3600))
+ANSWER_CACHE_SHARED = os.environ.get('ANSWER_CACHE_SHARED', '1').lower() in ('1', 'true', 'yes')
+
+# Negotiated response compression for large cached JSON bodies
+COMPRESSION_MIN_BYTES = int(os.environ.get('COMPRESSION_MIN_BYTES', 1024))
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', 6))
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', 5))
+ZSTD_LEVEL = int(os.environ.get('ZSTD_LEVEL', 6))
+
+# Service catalogue: the source for the chat prompt, fallback answers and /api/services
+SERVICE_CATALOGUE_PATH = os.environ.get(
+    'SERVICE_CATALOGUE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'catalogue.json')
+)
+SERVICES_CACHE_CONTROL = os.environ.get('SERVICES_CACHE_CONTROL', 'public, max-age=300')
+
+# Conversation memory keyed by ChatMessage.session_id
+SESSION_CACHE_ENTRIES = int(os.environ.get('SESSION_CACHE_ENTRIES', 1000))
+SESSION_TTL = float(os.environ.get('SESSION_TTL', 24 * 3600))
+SESSION_MAX_TURNS = int(os.environ.get('SESSION_MAX_TURNS', 40))
+CHAT_HISTORY_TOKEN_BUDGET = int(os.environ.get('CHAT_HISTORY_TOKEN_BUDGET', 1200))
+CHAT_SUMMARY_TOKEN_BUDGET = int(os.environ.get('CHAT_SUMMARY_TOKEN_BUDGET', 150))
+
+# Admission control for upstream LLM calls, per worker process; overflow is answered by the keyword fallback
+LLM_MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', 8))
+LLM_QUEUE_SIZE = int(os.environ.get('LLM_QUEUE_SIZE', 32))
+LLM_QUEUE_TIMEOUT = float(os.environ.get('LLM_QUEUE_TIMEOUT', 2))
+# Per-client token buckets, one per address and one per session: sustained completions per second and burst size (0 disables)
+CHAT_RATE_PER_SECOND = float(os.environ.get('CHAT_RATE_PER_SECOND', 0.2))
+CHAT_RATE_BURST = int(os.environ.get('CHAT_RATE_BURST', 5))
+CHAT_RATE_CLIENTS = int(os.environ.get('CHAT_RATE_CLIENTS', 10000))
 
 # Models
 class GalleryImage(BaseModel):
     id: str
     filename: str
-    image_data: str
+    digest: Optional[str] = None  # sha256 of the bytes; keys the shared image_blobs entry
+    file_id: Optional[str] = None
+    content_type: Optional[str] = None
+    size: Optional[int] = None
+    image_data: Optional[str] = None  # legacy inline base64, see migrate_gallery_to_gridfs
     description: Optional[str] = None
     uploaded_at: datetime
 
@@ -56,6 +239,254 @@ class ChatMessage(BaseModel):
     message: str
     session_id: Optional[str] = None
 
+class LRUCache:
+    """Ordered-dict LRU bounded by entry count and/or total size, with optional TTL"""
+
+    def __init__(self, max_entries: Optional[int] = None, max_bytes: Optional[int] = None, ttl: Optional[float] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        value, size, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            self.discard(key)
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, size: int = 0):
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        self.discard(key)
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        self._data[key] = (value, size, expires_at)
+        self.current_bytes += size
+        while self._data and (
+            (self.max_entries is not None and len(self._data) > self.max_entries)
+            or (self.max_bytes is not None and self.current_bytes > self.max_bytes)
+        ):
+            _, (_, evicted_size, _) = self._data.popitem(last=False)
+            self.current_bytes -= evicted_size
+
+    def discard(self, key):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.current_bytes -= entry[1]
+
+    def clear(self):
+        self._data.clear()
+        self.current_bytes = 0
+
+class InFlight:
+    """A shared task and the number of callers still waiting on it"""
+
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+class SharedStream(InFlight):
+    """One upstream iterator pumped into a buffer that every subscriber replays"""
+
+    def __init__(self, source):
+        self.chunks = []
+        self.finished = False
+        self.error = None
+        self.changed = asyncio.Event()
+        super().__init__(asyncio.ensure_future(self.pump(source)))
+
+    async def pump(self, source):
+        try:
+            async for chunk in source:
+                self.chunks.append(chunk)
+                self.notify()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.finished = True
+            self.notify()
+            await source.aclose()
+
+    def notify(self):
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+class SingleFlight:
+    """Collapses concurrent identical calls into one shared task keyed by the caller"""
+
+    def __init__(self):
+        self.leaders = 0
+        self.followers = 0
+        self._calls = {}
+        self._streams = {}
+
+    def _join(self, table, key, start):
+        flight = table.get(key)
+        if flight is None:
+            flight = table[key] = start()
+            flight.task.add_done_callback(lambda _: self._forget(table, key, flight))
+            self.leaders += 1
+        else:
+            self.followers += 1
+        flight.waiters += 1
+        return flight
+
+    def in_flight(self, key, stream: bool = False):
+        """Whether a call for key is running, so a caller would join it rather than lead"""
+        return key in (self._streams if stream else self._calls)
+
+    @staticmethod
+    def _forget(table, key, flight):
+        if table.get(key) is flight:
+            del table[key]
+
+    def _leave(self, table, key, flight, finished: bool):
+        flight.waiters -= 1
+        # The last caller to give up cancels the shared work
+        if flight.waiters == 0 and not finished:
+            self._forget(table, key, flight)
+            flight.task.cancel()
+
+    async def do(self, key, factory):
+        """Await factory() once per key; concurrent callers share its result or exception"""
+        flight = self._join(self._calls, key, lambda: InFlight(asyncio.ensure_future(factory())))
+        try:
+            # Shielded so one caller's cancellation does not cancel the others
+            return await asyncio.shield(flight.task)
+        finally:
+            self._leave(self._calls, key, flight, flight.task.done())
+
+    async def stream(self, key, factory):
+        """Iterate factory() once per key; late subscribers first replay the chunks they missed"""
+        shared = self._join(self._streams, key, lambda: SharedStream(factory()))
+        try:
+            index = 0
+            while True:
+                if index < len(shared.chunks):
+                    yield shared.chunks[index]
+                    index += 1
+                elif shared.finished:
+                    if shared.error is not None:
+                        raise shared.error
+                    return
+                else:
+                    await shared.changed.wait()
+        finally:
+            self._leave(self._streams, key, shared, shared.finished)
+
+# Serialized gallery pages keyed by (version, after, limit); image bytes keyed by (image_id, width)
+gallery_version = 0
+# Last seen cache_versions document: {"version": every gallery change, "deletes": image deletions}
+shared_gallery_versions = None
+shared_versions_checked_at = 0.0
+gallery_page_cache = LRUCache(max_entries=GALLERY_CACHE_ENTRIES, ttl=GALLERY_CACHE_TTL)
+image_bytes_cache = LRUCache(max_bytes=IMAGE_CACHE_MAX_BYTES, ttl=IMAGE_CACHE_TTL)
+gallery_flight = SingleFlight()
+
+# Chat answers keyed by prompt fingerprint + normalized question; Mongo holds the shared tier
+answer_cache = LRUCache(max_entries=ANSWER_CACHE_ENTRIES, ttl=ANSWER_CACHE_TTL)
+answer_cache_stats = {"hits": 0, "shared_hits": 0, "misses": 0, "stores": 0}
+# Identical uncached questions in flight at once share one upstream call
+chat_flight = SingleFlight()
+
+# Recent conversations (session_id -> list of turns); Mongo chat_sessions is the durable copy
+session_cache = LRUCache(max_entries=SESSION_CACHE_ENTRIES, ttl=SESSION_TTL)
+
+class LLMOverloaded(Exception):
+    """Raised when an upstream LLM call cannot be admitted; reason is queue_full or queue_timeout"""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+class AdmissionController:
+    """Caps in-flight LLM calls, queues a bounded number of waiters and sheds the rest"""
+
+    def __init__(self, max_concurrency: int, queue_size: int, queue_timeout: float):
+        self.max_concurrency = max_concurrency
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.shed = {"queue_full": 0, "queue_timeout": 0}
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    @asynccontextmanager
+    async def slot(self):
+        if self._semaphore.locked():
+            # Shed immediately rather than let the queue (and tail latency) grow unbounded
+            if self.waiting >= self.queue_size:
+                self.shed["queue_full"] += 1
+                raise LLMOverloaded("queue_full")
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.shed["queue_timeout"] += 1
+                raise LLMOverloaded("queue_timeout")
+            finally:
+                self.waiting -= 1
+        else:
+            await self._semaphore.acquire()
+        self.in_flight += 1
+        self.admitted += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+class TokenBucketLimiter:
+    """Per-client token buckets kept in a bounded LRU so idle clients age out"""
+
+    def __init__(self, rate: float, burst: int, max_clients: int):
+        self.rate = rate
+        self.burst = burst
+        self.limited = 0
+        self._buckets = LRUCache(max_entries=max_clients)
+
+    def allow(self, client_key: str):
+        if self.rate <= 0:
+            return True
+        now = time.monotonic()
+        bucket = self._buckets.get(client_key)
+        if bucket is None:
+            bucket = [float(self.burst), now]
+            self._buckets.set(client_key, bucket)
+        tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if tokens < 1:
+            bucket[0] = tokens
+            self.limited += 1
+            return False
+        bucket[0] = tokens - 1
+        return True
+
+    def allow_all(self, client_keys):
+        """Take a token from every key's bucket, stopping at the first one that is empty"""
+        return all(self.allow(client_key) for client_key in client_keys)
+
+llm_admission = AdmissionController(LLM_MAX_CONCURRENCY, LLM_QUEUE_SIZE, LLM_QUEUE_TIMEOUT)
+chat_rate_limiter = TokenBucketLimiter(CHAT_RATE_PER_SECOND, CHAT_RATE_BURST, CHAT_RATE_CLIENTS)
+
+# Per-route latency, status and payload metrics
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+
 # Default admin credentials (change these later)
 DEFAULT_ADMIN = {
     "username": "admin",
@@ -80,10 +511,471 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
     except jwt.PyJWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
+def guess_content_type(filename: Optional[str], declared: Optional[str] = None):
+    if declared and declared.startswith("image/"):
+        return declared
+    guessed, _ = mimetypes.guess_type(filename or "")
+    return guessed or "application/octet-stream"
+
+def detect_image_type(fileobj):
+    """MIME type of the image Pillow finds in `fileobj`, or None when it is not a readable image"""
+    from PIL import Image
+
+    try:
+        fileobj.seek(0)
+        with Image.open(fileobj) as image:
+            image_format = image.format
+            image.verify()
+    except Exception:
+        return None
+    finally:
+        fileobj.seek(0)
+    content_type = Image.MIME.get(image_format)
+    return content_type if content_type and content_type.startswith("image/") else None
+
+def served_content_type(content_type: Optional[str]):
+    # Never let stored bytes be interpreted as markup or script from the API origin
+    return content_type if content_type and content_type.startswith("image/") else "application/octet-stream"
+
+def raw_image_url(image_id: str, digest: Optional[str] = None):
+    url = f"/api/gallery/{image_id}/raw"
+    return f"{url}?v={digest[:16]}" if digest else url
+
+async def store_image_bytes(
+    file: UploadFile,
+    content_type: str,
+    max_bytes: int = MAX_UPLOAD_BYTES,
+    budget: Optional[dict] = None,
+):
+    """Stream an upload into GridFS chunk by chunk, returning (file_id, size, sha256 hex digest)
+
+    `max_bytes` caps this file; `budget["remaining"]` is a byte allowance shared by a whole batch.
+    """
+    grid_in = gallery_fs.open_upload_stream(
+        file.filename or "upload",
+        metadata={"contentType": content_type},
+    )
+    size = 0
+    hasher = hashlib.sha256()
+    try:
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                raise HTTPException(status_code=413, detail=f"File exceeds {max_bytes} bytes")
+            if budget is not None:
+                budget["remaining"] -= len(chunk)
+                if budget["remaining"] < 0:
+                    raise HTTPException(status_code=413, detail=f"Request exceeds {BATCH_MAX_BYTES} bytes")
+            hasher.update(chunk)
+            await grid_in.write(chunk)
+        await grid_in.close()
+    except Exception:
+        await grid_in.abort()
+        raise
+    return grid_in._id, size, hasher.hexdigest()
+
+async def acquire_blob(digest: str, file_id, size: int, content_type: str, derivatives: Optional[List[dict]] = None):
+    """Take a reference on the blob stored under `digest`, registering `file_id` if the digest is new
+
+    Returns the blob document; when its `file_id` differs from ours the bytes were already stored.
+    """
+    on_insert = {"file_id": file_id, "size": size, "content_type": content_type, "created_at": datetime.utcnow()}
+    if derivatives is not None:
+        on_insert["derivatives"] = derivatives
+    try:
+        return await db.image_blobs.find_one_and_update(
+            {"_id": digest},
+            {"$inc": {"refs": 1}, "$setOnInsert": on_insert},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+    except DuplicateKeyError:
+        # Lost an upsert race with an identical upload; the blob exists now
+        return await db.image_blobs.find_one_and_update(
+            {"_id": digest}, {"$inc": {"refs": 1}}, return_document=ReturnDocument.AFTER
+        )
+
+async def release_image_files(image: dict):
+    """Drop one reference to an image's bytes, deleting them once nothing points at them"""
+    digest = image.get("digest")
+    if digest is None:
+        await delete_grid_files(gallery_item_files(image))
+        return
+    blob = await db.image_blobs.find_one_and_update(
+        {"_id": digest}, {"$inc": {"refs": -1}}, return_document=ReturnDocument.AFTER
+    )
+    if blob is None or blob["refs"] > 0:
+        return
+    # Only delete if no upload re-acquired the blob in the meantime
+    result = await db.image_blobs.delete_one({"_id": digest, "refs": {"$lte": 0}})
+    if result.deleted_count:
+        await delete_grid_files(gallery_item_files(blob))
+
+def render_derivatives(path: str, widths: List[int], image_format: str, quality: int):
+    """Resize the image at `path` to each requested width; runs inside the derivative process pool"""
+    from PIL import Image, ImageOps, features
+
+    if image_format == "WEBP" and not features.check("webp"):
+        image_format = "JPEG"
+    with Image.open(path) as source:
+        source = ImageOps.exif_transpose(source)
+        if image_format == "JPEG" and source.mode != "RGB":
+            source = source.convert("RGB")
+        elif source.mode not in ("RGB", "RGBA"):
+            source = source.convert("RGBA" if "A" in source.getbands() else "RGB")
+
+        derivatives = []
+        for width in sorted(set(widths)):
+            # Never upscale; the original already covers larger widths
+            if width >= source.width:
+                continue
+            height = max(round(source.height * width / source.width), 1)
+            resized = source.resize((width, height), Image.LANCZOS)
+            buffer = io.BytesIO()
+            resized.save(buffer, format=image_format, quality=quality, optimize=True)
+            derivatives.append({
+                "width": width,
+                "height": height,
+                "content_type": f"image/{image_format.lower()}",
+                "data": buffer.getvalue(),
+            })
+        return derivatives
+
+def get_derivative_pool():
+    global derivative_pool
+    if derivative_pool is None:
+        # Spawn rather than fork: Motor, pymongo and sampler threads may hold locks at fork time
+        derivative_pool = ProcessPoolExecutor(
+            max_workers=DERIVATIVE_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return derivative_pool
+
+def derivative_worker_ready():
+    return os.getpid()
+
+def start_derivative_pool():
+    """Start every derivative worker now so the first upload doesn't wait for them to import"""
+    pool = get_derivative_pool()
+    if pool is not None:
+        # The pool spawns one process per task submitted while none is idle
+        for _ in range(pool._max_workers):
+            pool.submit(derivative_worker_ready)
+
+async def spool_to_disk(source):
+    """Copy an upload or GridFS download to a temporary file chunk by chunk, returning its path"""
+    handle = tempfile.NamedTemporaryFile(prefix="derivative-", delete=False)
+    try:
+        with handle:
+            while True:
+                chunk = await source.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                await asyncio.to_thread(handle.write, chunk)
+    except Exception:
+        os.remove(handle.name)
+        raise
+    return handle.name
+
+async def create_derivatives(image_id: str, filename: Optional[str], source):
+    """Render derivatives off the event loop and store them in GridFS next to the original
+
+    `source` is read in chunks; the pool worker opens a spooled copy on disk rather than being
+    sent the whole original.
+    """
+    path = await spool_to_disk(source)
+    try:
+        loop = asyncio.get_running_loop()
+        rendered = await loop.run_in_executor(
+            get_derivative_pool(),
+            render_derivatives,
+            path,
+            DERIVATIVE_WIDTHS,
+            DERIVATIVE_FORMAT,
+            DERIVATIVE_QUALITY,
+        )
+    finally:
+        os.remove(path)
+    derivatives = []
+    for item in rendered:
+        file_id = await gallery_fs.upload_from_stream(
+            f"{filename or image_id}.{item['width']}w",
+            item["data"],
+            metadata={"contentType": item["content_type"], "derivative_of": image_id, "width": item["width"]},
+        )
+        derivatives.append({
+            "width": item["width"],
+            "height": item["height"],
+            "content_type": item["content_type"],
+            "size": len(item["data"]),
+            "file_id": file_id,
+        })
+    return derivatives
+
+def derivative_url(image_id: str, width: int, digest: Optional[str] = None):
+    url = f"/api/gallery/{image_id}/w/{width}"
+    return f"{url}?v={digest[:16]}" if digest else url
+
+def add_image_urls(image: dict):
+    digest = image.get('digest')
+    image['raw_url'] = raw_image_url(image['id'], digest)
+    derivatives = sorted(image.get('derivatives') or [], key=lambda d: d['width'])
+    if derivatives:
+        image['thumbnail_url'] = derivative_url(image['id'], derivatives[0]['width'], digest)
+        image['srcset'] = ", ".join(
+            f"{derivative_url(image['id'], d['width'], digest)} {d['width']}w" for d in derivatives
+        )
+    else:
+        image['thumbnail_url'] = image['raw_url']
+        image['srcset'] = None
+    return image
+
+async def delete_grid_files(file_ids):
+    for file_id in file_ids:
+        try:
+            await gallery_fs.delete(file_id)
+        except gridfs.NoFile:
+            pass
+
+def invalidate_gallery(image_id: Optional[str] = None, widths: Optional[List[int]] = None):
+    """Write-through invalidation: bump the listing version and drop cached bytes for `image_id`"""
+    global gallery_version
+    gallery_version += 1
+    gallery_page_cache.clear()
+    if image_id is not None:
+        for width in [None] + list(widths or []):
+            image_bytes_cache.discard((image_id, width))
+
+async def publish_gallery_change(image_id: Optional[str] = None, widths: Optional[List[int]] = None):
+    """Invalidate this process's gallery caches and bump the shared version so other workers follow"""
+    invalidate_gallery(image_id, widths)
+    try:
+        await db.cache_versions.update_one(
+            {"_id": "gallery"}, {"$inc": {"version": 1, "deletes": 1 if image_id is not None else 0}}, upsert=True
+        )
+    except Exception as e:
+        print(f"Cache version error: {str(e)}")
+
+async def sync_gallery_caches():
+    """Drop gallery caches filled before another process changed the gallery"""
+    global shared_gallery_versions, shared_versions_checked_at
+    now = time.monotonic()
+    if CACHE_SYNC_INTERVAL < 0 or now - shared_versions_checked_at < CACHE_SYNC_INTERVAL:
+        return
+    shared_versions_checked_at = now
+    try:
+        doc = await db.cache_versions.find_one({"_id": "gallery"}) or {}
+    except Exception as e:
+        print(f"Cache version error: {str(e)}")
+        return
+    versions = (doc.get("version", 0), doc.get("deletes", 0))
+    previous, shared_gallery_versions = shared_gallery_versions, versions
+    # Our own bumps land here too; clearing once more is cheaper than risking a stale page
+    if previous is not None and versions[0] != previous[0]:
+        invalidate_gallery()
+    if previous is not None and versions[1] != previous[1]:
+        image_bytes_cache.clear()
+
+def make_etag(data: bytes):
+    return '"' + hashlib.sha256(data).hexdigest()[:32] + '"'
+
+def etag_matches(if_none_match: Optional[str], etag: str):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return any((tag[2:] if tag.startswith("W/") else tag) == etag for tag in candidates)
+
+def not_modified(etag: str, cache_control: str):
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
+
+def json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def dump_json(data):
+    """Compact UTF-8 JSON; datetimes serialize natively without mutating the documents"""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(",", ":"), default=json_default).encode("utf-8")
+
+# Supported content codings, most preferred first
+RESPONSE_ENCODERS = {}
+if zstandard is not None:
+    RESPONSE_ENCODERS["zstd"] = lambda data: zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+if brotli is not None:
+    RESPONSE_ENCODERS["br"] = lambda data: brotli.compress(data, quality=BROTLI_QUALITY)
+RESPONSE_ENCODERS["gzip"] = lambda data: gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+@functools.lru_cache(maxsize=256)
+def negotiate_encoding(accept_encoding: Optional[str]):
+    """Pick the preferred supported coding with the highest q-value, or None for identity"""
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip().lower()] = quality
+    best, best_quality = None, 0.0
+    for coding in RESPONSE_ENCODERS:
+        quality = accepted.get(coding, accepted.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+class EncodedBody:
+    """A serialized body, its ETag and the compressed variants made from it so far"""
+
+    def __init__(self, body: bytes, etag: Optional[str] = None):
+        self.body = body
+        self.etag = etag or make_etag(body)
+        self.variants = {}
+
+    def encode(self, encoding: Optional[str]):
+        """Return (data, encoding); small or incompressible bodies are sent as identity"""
+        if encoding is None or len(self.body) < COMPRESSION_MIN_BYTES:
+            return self.body, None
+        data = self.variants.get(encoding)
+        if data is None:
+            data = self.variants[encoding] = RESPONSE_ENCODERS[encoding](self.body)
+        if len(data) >= len(self.body):
+            return self.body, None
+        return data, encoding
+
+def encoded_response(request: Request, payload: EncodedBody, headers: dict, media_type: str = "application/json"):
+    """Send `payload` in the client's preferred encoding, or 304 when its ETag still matches"""
+    data, encoding = payload.encode(negotiate_encoding(request.headers.get("accept-encoding")))
+    # Each representation gets its own strong validator
+    etag = payload.etag if encoding is None else f'{payload.etag[:-1]}-{encoding}"'
+    headers = {**headers, "ETag": etag, "Vary": "Accept-Encoding"}
+    if_none_match = request.headers.get("if-none-match")
+    if etag_matches(if_none_match, etag) or etag_matches(if_none_match, payload.etag):
+        return Response(status_code=304, headers=headers)
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    return Response(data, media_type=media_type, headers=headers)
+
+def encode_gallery_cursor(image: dict):
+    """Opaque keyset cursor pointing just past `image` in (uploaded_at, id) order"""
+    raw = f"{image['uploaded_at'].isoformat()}|{image['id']}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def decode_gallery_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        uploaded_at, image_id = raw.split("|", 1)
+        return datetime.fromisoformat(uploaded_at), image_id
+    except (ValueError, UnicodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def parse_range_header(range_header: Optional[str], size: int):
+    """Parse a single-range `bytes=` header into an inclusive (start, end) pair"""
+    if not range_header:
+        return None
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    start_text, _, end_text = spec.strip().partition("-")
+    try:
+        if start_text:
+            start = int(start_text)
+            end = int(end_text) if end_text else size - 1
+        else:
+            # Suffix range: the last N bytes
+            suffix = int(end_text)
+            if suffix <= 0:
+                raise ValueError
+            start = max(size - suffix, 0)
+            end = size - 1
+    except ValueError:
+        return None
+    end = min(end, size - 1)
+    if start > end or start >= size:
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"},
+        )
+    return start, end
+
+async def iter_grid_out(grid_out, start: int, length: int):
+    grid_out.seek(start)
+    remaining = length
+    while remaining > 0:
+        chunk = await grid_out.read(min(UPLOAD_CHUNK_SIZE, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        yield chunk
+
+def connect_mongo():
+    global client, db, gallery_fs
+    if client is None:
+        options = {
+            "maxPoolSize": MONGO_MAX_POOL_SIZE,
+            "minPoolSize": MONGO_MIN_POOL_SIZE,
+            "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+            "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+            "socketTimeoutMS": MONGO_SOCKET_TIMEOUT_MS,
+        }
+        if MONGO_COMPRESSORS:
+            options["compressors"] = MONGO_COMPRESSORS
+        if METRICS_ENABLED:
+            options["event_listeners"] = [MongoCommandMetrics()]
+        client = AsyncIOMotorClient(MONGO_URL, **options)
+        db = client.beauty_salon
+        gallery_fs = AsyncIOMotorGridFSBucket(db, bucket_name=GALLERY_BUCKET, chunk_size_bytes=UPLOAD_CHUNK_SIZE)
+    return db
+
+def close_mongo():
+    global client, db, gallery_fs
+    if client is not None:
+        client.close()
+        client = db = gallery_fs = None
+
+async def ensure_indexes():
+    """Create the indexes hot queries rely on; create_index is a no-op when they already exist"""
+    indexes = [
+        (db.gallery, [("id", 1)], {"unique": True}),
+        # Serves both the keyset-paginated listing and plain uploaded_at sorts
+        (db.gallery, [("uploaded_at", -1), ("id", -1)], {}),
+        # image_blobs is keyed by digest (_id), which is unique by construction
+        (db.gallery, [("digest", 1)], {}),
+        (db.chat_sessions, [("expires_at", 1)], {"expireAfterSeconds": 0}),
+    ]
+    if ANSWER_CACHE_SHARED:
+        indexes.append((db.chat_answer_cache, [("expires_at", 1)], {"expireAfterSeconds": 0}))
+    results = await asyncio.gather(
+        *(collection.create_index(keys, **options) for collection, keys, options in indexes),
+        return_exceptions=True,
+    )
+    for (collection, keys, _), result in zip(indexes, results):
+        if isinstance(result, Exception):
+            print(f"Index error on {collection.name} {keys}: {str(result)}")
+
 # Routes
 @app.get("/api/health")
 async def health_check():
-    return {"status": "healthy"}
+    try:
+        started = time.perf_counter()
+        await asyncio.wait_for(db.command("ping"), timeout=HEALTH_PING_TIMEOUT)
+        ping_ms = (time.perf_counter() - started) * 1000
+        return {"status": "healthy", "mongo": {"ok": True, "ping_ms": round(ping_ms, 2)}}
+    except Exception as e:
+        print(f"Health ping error: {str(e)}")
+        return {"status": "degraded", "mongo": {"ok": False, "error": str(e)}}
 
 @app.post("/api/admin/login")
 async def admin_login(login_data: AdminLogin):
@@ -93,20 +985,129 @@ async def admin_login(login_data: AdminLogin):
     raise HTTPException(status_code=401, detail="Invalid credentials")
 
 @app.get("/api/gallery")
-async def get_gallery():
+async def get_gallery(
+    request: Request,
+    after: Optional[str] = None,
+    limit: int = Query(GALLERY_PAGE_SIZE, ge=1, le=GALLERY_MAX_PAGE_SIZE),
+):
+    await sync_gallery_caches()
+    cache_key = (gallery_version, after, limit)
+    cached = gallery_page_cache.get(cache_key)
+    if cached is None:
+        # Concurrent misses for the same page share one Mongo query
+        cached = await gallery_flight.do(cache_key, lambda: load_gallery_page(after, limit))
+        if cached is None:
+            return []  # Return empty list instead of error
+        # Only cache if no upload/delete happened while the query was running
+        if cache_key[0] == gallery_version:
+            gallery_page_cache.set(cache_key, cached)
+
+    payload, next_cursor = cached
+    headers = {"Cache-Control": GALLERY_CACHE_CONTROL}
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    return encoded_response(request, payload, headers)
+
+async def load_gallery_page(after: Optional[str], limit: int):
+    """Query and serialize one gallery page, returning (EncodedBody, next_cursor)"""
+    query = {}
+    if after:
+        after_uploaded_at, after_id = decode_gallery_cursor(after)
+        query = {"$or": [
+            {"uploaded_at": {"$lt": after_uploaded_at}},
+            {"uploaded_at": after_uploaded_at, "id": {"$lt": after_id}},
+        ]}
     try:
         gallery_collection = db.gallery
-        images = await gallery_collection.find({}).to_list(100)
-        # Convert ObjectId to string and handle datetime serialization
-        for image in images:
-            if '_id' in image:
-                del image['_id']
-            if isinstance(image.get('uploaded_at'), datetime):
-                image['uploaded_at'] = image['uploaded_at'].isoformat()
-        return images
+        cursor = gallery_collection.find(query, GALLERY_LIST_PROJECTION)
+        cursor = cursor.sort([("uploaded_at", -1), ("id", -1)]).limit(limit + 1)
+        images = await cursor.to_list(limit + 1)
+        # Fetch one extra document to learn whether another page exists
+        has_more = len(images) > limit
+        images = images[:limit]
+        next_cursor = encode_gallery_cursor(images[-1]) if has_more else None
+        with GALLERY_SERIALIZE_SECONDS.time():
+            for image in images:
+                add_image_urls(image)
+            body = dump_json(images)
+        return EncodedBody(body), next_cursor
     except Exception as e:
         print(f"Gallery error: {str(e)}")
-        return []  # Return empty list instead of error
+        return None
+
+async def prepare_gallery_item(
+    file: UploadFile,
+    description: str,
+    max_bytes: int = MAX_UPLOAD_BYTES,
+    budget: Optional[dict] = None,
+):
+    """Store an upload and its derivatives in GridFS and build its (not yet inserted) gallery document"""
+    if not guess_content_type(file.filename, file.content_type).startswith("image/"):
+        raise HTTPException(status_code=415, detail="Only image uploads are accepted")
+    # Reject oversized files before Pillow parses them; store_image_bytes still caps unsized streams
+    if file.size is not None and file.size > max_bytes:
+        raise HTTPException(status_code=413, detail=f"File exceeds {max_bytes} bytes")
+    # The stored type comes from the decoded bytes, not the client's filename or header
+    content_type = await asyncio.to_thread(detect_image_type, file.file)
+    if content_type is None:
+        raise HTTPException(status_code=415, detail="File is not a readable image")
+    # Stream file content into GridFS
+    file_id, size, digest = await store_image_bytes(file, content_type, max_bytes, budget)
+    image_id = str(uuid.uuid4())
+
+    # Identical bytes may already be stored with their derivatives, in which case nothing is rendered
+    existing = await db.image_blobs.find_one({"_id": digest}, {"derivatives": 1})
+    derivatives = None
+    if existing is None or existing.get("derivatives") is None:
+        # Render before publishing the blob so no identical upload can share it without derivatives
+        try:
+            await file.seek(0)
+            derivatives = await create_derivatives(image_id, file.filename, file)
+        except Exception as derivative_error:
+            # Left unset (pending) so a later identical upload or backfill-derivatives fills it in
+            print(f"Derivative error for {image_id}: {str(derivative_error)}")
+    rendered_ids = {d["file_id"] for d in derivatives or []}
+
+    try:
+        blob = await acquire_blob(digest, file_id, size, content_type, derivatives)
+    except Exception:
+        await delete_grid_files([file_id, *rendered_ids])
+        raise
+
+    if blob["file_id"] != file_id:
+        # Identical bytes are already stored: share them and drop the copies just written
+        if derivatives is not None and blob.get("derivatives") is None:
+            # A blob still pending derivatives adopts ours unless another upload got there first
+            blob = await db.image_blobs.find_one_and_update(
+                {"_id": digest, "derivatives": {"$exists": False}},
+                {"$set": {"derivatives": derivatives}},
+                return_document=ReturnDocument.AFTER,
+            ) or await db.image_blobs.find_one({"_id": digest})
+        shared_ids = {d["file_id"] for d in blob.get("derivatives") or []}
+        await delete_grid_files([file_id, *(rendered_ids - shared_ids)])
+        file_id = blob["file_id"]
+        content_type = blob["content_type"]
+        derivatives = blob.get("derivatives")
+
+    gallery_item = {
+        "id": image_id,
+        "filename": file.filename,
+        "digest": digest,
+        "file_id": file_id,
+        "content_type": content_type,
+        "size": size,
+        "description": description,
+        "uploaded_at": datetime.utcnow()
+    }
+    if derivatives is not None:
+        gallery_item["derivatives"] = derivatives
+    return gallery_item
+
+def gallery_item_files(item: dict):
+    file_ids = [d["file_id"] for d in item.get("derivatives") or []]
+    if item.get("file_id") is not None:
+        file_ids.append(item["file_id"])
+    return file_ids
 
 @app.post("/api/gallery")
 async def upload_image(
@@ -115,144 +1116,1040 @@ async def upload_image(
     username: str = Depends(verify_token)
 ):
     try:
-        # Read file content
-        file_content = await file.read()
-        
-        # Encode image to base64
-        image_data = base64.b64encode(file_content).decode('utf-8')
-        
-        # Create gallery item
-        gallery_item = {
-            "id": str(uuid.uuid4()),
-            "filename": file.filename,
-            "image_data": image_data,
-            "description": description,
-            "uploaded_at": datetime.utcnow()
-        }
+        gallery_item = await prepare_gallery_item(file, description)
         
         # Save to database
         gallery_collection = db.gallery
-        await gallery_collection.insert_one(gallery_item)
+        try:
+            await gallery_collection.insert_one(gallery_item)
+        except Exception:
+            await release_image_files(gallery_item)
+            raise
+        await publish_gallery_change()
         
-        return {"message": "Image uploaded successfully", "id": gallery_item["id"]}
+        return {
+            "message": "Image uploaded successfully",
+            "id": gallery_item["id"],
+            "digest": gallery_item["digest"],
+            "raw_url": raw_image_url(gallery_item["id"], gallery_item["digest"]),
+            "srcset": add_image_urls(dict(gallery_item))["srcset"]
+        }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/gallery/batch")
+async def upload_images_batch(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    description: str = Form(""),
+    descriptions: List[str] = Form([]),
+    username: str = Depends(verify_token)
+):
+    if len(files) > BATCH_MAX_FILES:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_FILES} files per batch")
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > BATCH_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"Request exceeds {BATCH_MAX_BYTES} bytes")
+
+    budget = {"remaining": BATCH_MAX_BYTES}
+    semaphore = asyncio.Semaphore(BATCH_UPLOAD_CONCURRENCY)
+    report = [{"filename": file.filename, "status": "pending"} for file in files]
+
+    async def process(index: int, file: UploadFile):
+        file_description = descriptions[index] if index < len(descriptions) else description
+        async with semaphore:
+            try:
+                return await prepare_gallery_item(file, file_description, MAX_UPLOAD_BYTES, budget)
+            except HTTPException as e:
+                report[index].update(status="error", error=e.detail)
+            except Exception as e:
+                report[index].update(status="error", error=str(e))
+            return None
+
+    items = await asyncio.gather(*(process(index, file) for index, file in enumerate(files)))
+    prepared = [(index, item) for index, item in enumerate(items) if item is not None]
+
+    # One round-trip for all metadata; unordered so one bad document does not block the rest
+    failed = {}
+    if prepared:
+        try:
+            await db.gallery.insert_many([item for _, item in prepared], ordered=False)
+        except BulkWriteError as e:
+            for write_error in e.details.get("writeErrors", []):
+                failed[write_error["index"]] = write_error.get("errmsg", "Insert failed")
+        except Exception as e:
+            failed = {position: str(e) for position in range(len(prepared))}
+        await publish_gallery_change()
+
+    for position, (index, item) in enumerate(prepared):
+        if position in failed:
+            await release_image_files(item)
+            report[index].update(status="error", error=failed[position])
+        else:
+            report[index].update(
+                status="ok",
+                id=item["id"],
+                size=item["size"],
+                digest=item["digest"],
+                raw_url=raw_image_url(item["id"], item["digest"]),
+            )
+
+    uploaded = sum(1 for entry in report if entry["status"] == "ok")
+    return {
+        "message": f"Uploaded {uploaded} of {len(files)} images",
+        "uploaded": uploaded,
+        "failed": len(files) - uploaded,
+        "files": report,
+    }
+
+@app.get("/api/gallery/{image_id}/raw")
+async def get_image_raw(image_id: str, request: Request):
+    await sync_gallery_caches()
+    cache_key = (image_id, None)
+    cached = image_bytes_cache.get(cache_key)
+    if cached is not None:
+        return image_response(*cached, request)
+
+    version = gallery_version
+    image = await db.gallery.find_one({"id": image_id}, {"_id": 0})
+    if image is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    content_type = image.get("content_type") or guess_content_type(image.get("filename"))
+
+    if image.get("file_id") is None:
+        # Legacy document that has not been migrated to GridFS yet
+        if not image.get("image_data"):
+            raise HTTPException(status_code=404, detail="Image data not found")
+        data = base64.b64decode(image["image_data"])
+        entry = (data, content_type, make_etag(data), IMAGE_CACHE_CONTROL)
+        if version == gallery_version:
+            image_bytes_cache.set(cache_key, entry, len(data))
+        return image_response(*entry, request)
+
+    digest = image.get("digest")
+    return await serve_grid_file(
+        cache_key, image["file_id"], content_type, request, version,
+        etag=f'"{digest}"' if digest else None,
+        cache_control=IMMUTABLE_CACHE_CONTROL if digest else IMAGE_CACHE_CONTROL,
+    )
+
+@app.get("/api/gallery/{image_id}/w/{width}")
+async def get_image_derivative(image_id: str, width: int, request: Request):
+    await sync_gallery_caches()
+    cache_key = (image_id, width)
+    cached = image_bytes_cache.get(cache_key)
+    if cached is not None:
+        return image_response(*cached, request)
+
+    version = gallery_version
+    image = await db.gallery.find_one({"id": image_id}, {"_id": 0, "derivatives": 1, "digest": 1})
+    if image is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    digest = image.get("digest")
+    for derivative in image.get("derivatives") or []:
+        if derivative["width"] == width:
+            return await serve_grid_file(
+                cache_key, derivative["file_id"], derivative["content_type"], request, version,
+                etag=f'"{digest}-{width}"' if digest else None,
+                cache_control=IMMUTABLE_CACHE_CONTROL if digest else IMAGE_CACHE_CONTROL,
+            )
+    raise HTTPException(status_code=404, detail="Derivative not found")
+
+def image_response(data: bytes, content_type: str, etag: str, cache_control: str, request: Request):
+    """Serve in-memory image bytes with conditional and Range request support"""
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return not_modified(etag, cache_control)
+    content_type = served_content_type(content_type)
+    headers = {"Accept-Ranges": "bytes", "ETag": etag, "Cache-Control": cache_control, **IMAGE_SECURITY_HEADERS}
+    byte_range = parse_range_header(request.headers.get("range"), len(data))
+    if byte_range is None:
+        return Response(data, media_type=content_type, headers=headers)
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+    return Response(data[start:end + 1], status_code=206, media_type=content_type, headers=headers)
+
+async def serve_grid_file(
+    cache_key,
+    file_id,
+    content_type: str,
+    request: Request,
+    version: int,
+    etag: Optional[str] = None,
+    cache_control: str = IMAGE_CACHE_CONTROL,
+):
+    # GridFS files are never rewritten, so the file id is a strong validator when there is no digest
+    etag = etag or f'"{file_id}"'
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return not_modified(etag, cache_control)
+
+    try:
+        grid_out = await gallery_fs.open_download_stream(file_id)
+    except gridfs.NoFile:
+        raise HTTPException(status_code=404, detail="Image data not found")
+
+    size = grid_out.length
+    if size <= IMAGE_CACHE_MAX_ITEM_BYTES:
+        data = await grid_out.read()
+        entry = (data, content_type, etag, cache_control)
+        if version == gallery_version:
+            image_bytes_cache.set(cache_key, entry, len(data))
+        return image_response(*entry, request)
+
+    byte_range = parse_range_header(request.headers.get("range"), size)
+    headers = {"Accept-Ranges": "bytes", "ETag": etag, "Cache-Control": cache_control, **IMAGE_SECURITY_HEADERS}
+    if byte_range is None:
+        start, end, status_code = 0, size - 1, 200
+    else:
+        start, end = byte_range
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    length = max(end - start + 1, 0)
+    headers["Content-Length"] = str(length)
+
+    return StreamingResponse(
+        iter_grid_out(grid_out, start, length),
+        status_code=status_code,
+        media_type=served_content_type(content_type),
+        headers=headers,
+    )
+
 @app.delete("/api/gallery/{image_id}")
 async def delete_image(image_id: str, username: str = Depends(verify_token)):
     try:
         gallery_collection = db.gallery
-        result = await gallery_collection.delete_one({"id": image_id})
-        if result.deleted_count == 0:
+        image = await gallery_collection.find_one_and_delete(
+            {"id": image_id}, {"file_id": 1, "digest": 1, "derivatives.file_id": 1, "derivatives.width": 1}
+        )
+        if image is None:
             raise HTTPException(status_code=404, detail="Image not found")
+        await publish_gallery_change(image_id, [d["width"] for d in image.get("derivatives") or []])
+        await release_image_files(image)
         return {"message": "Image deleted successfully"}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/api/chat")
-async def chat_endpoint(chat_data: ChatMessage):
+def build_chat_messages(message: str, history: Optional[List[dict]] = None):
+    messages = [{"role": "system", "content": service_catalogue.system_prompt}]
+    messages.extend(trim_history(history or [], CHAT_HISTORY_TOKEN_BUDGET))
+    messages.append({"role": "user", "content": message})
+    return messages
+
+def estimate_tokens(text: str):
+    # Roughly four characters per token for English, plus per-message overhead
+    return len(text) // 4 + 4
+
+def trim_history(turns: List[dict], budget: int):
+    """Keep the newest turns that fit `budget` tokens; summarize the questions that were dropped"""
+    kept = []
+    used = 0
+    for index in range(len(turns) - 1, -1, -1):
+        cost = estimate_tokens(turns[index]["content"])
+        if used + cost > budget:
+            dropped = turns[:index + 1]
+            break
+        kept.append(turns[index])
+        used += cost
+    else:
+        dropped = []
+    kept.reverse()
+    # A reply without its question is confusing context, so start on a user turn
+    while kept and kept[0]["role"] != "user":
+        orphan = kept.pop(0)
+        used -= estimate_tokens(orphan["content"])
+        dropped.append(orphan)
+    if dropped:
+        summary = summarize_turns(dropped, min(CHAT_SUMMARY_TOKEN_BUDGET, max(budget - used, 0)))
+        if summary:
+            kept.insert(0, {"role": "system", "content": summary})
+    return kept
+
+def summarize_turns(turns: List[dict], budget: int):
+    """Cheap extractive summary of earlier customer questions, bounded by `budget` tokens"""
+    prefix = "Earlier in this conversation the customer asked about: "
+    remaining = (budget - estimate_tokens(prefix)) * 4
+    topics = []
+    for turn in reversed(turns):
+        if turn["role"] != "user":
+            continue
+        topic = " ".join(turn["content"].split())[:80]
+        if len(topic) + 2 > remaining:
+            break
+        topics.append(topic)
+        remaining -= len(topic) + 2
+    if not topics:
+        return None
+    return prefix + "; ".join(reversed(topics))
+
+async def load_session_history(session_id: str):
+    history = session_cache.get(session_id)
+    if history is not None:
+        return history
     try:
-        # Enhanced system prompt for beauty salon assistant
-        system_prompt = """You are a helpful beauty assistant for Femina Beauty Impression, a professional beauty salon located at 21-23 Woodgrange Road, London E7 8BA (Inside Post Office).
-
-Our services and pricing:
-THREADING: Eye Brow (£5), Upper Lip (£3), Chin (£3), Forehead (£3), Neck (£3), Side Face (£5), Full Face (£15)
-FACE WAXING: Eye Brows (£6), Upper Lip (£4), Chin (£4), Forehead (£4), Neck (£4), Side Face (£6), Full Face (£18)
-BODY WAXING: Half Arm (£12), Full Arm (£18), Under Arm (£8), Half Leg (£15), Full Leg (£25), Full Body Except Bikini (£60)
-PEDICURE & MANICURE: Pedicure (£25), Manicure (£20)
-EYELASH & TINTING: Full Set Cluster (From £18), Party Lashes (£8), Eye Brows Tinting (£6), Eye Lashes Tinting (£8)
-FACIAL & MASSAGE: Mini Facial (£15), Full Facial Cleansing/Whitening/Gold (£25), Herbal Facial (£30), Head Massage With/Without Herbal Oil (£15)
-HENNA & HAIR: One Hand/Foot Henna (From £5), Both Hands/Feet Henna (From £10), Hair Trimming (£7), Any Other Cut (From £12), Children Under 10 (£10)
-MAKEUP: Party Makeup (From £30), Bridal Makeup (From £150)
-
-Opening Hours: Monday-Saturday 11:00 AM to 6:00 PM
-Special appointments: 10:00 AM-11:00 AM and 6:00 PM-7:00 PM by appointment only
-Phone: +44 7368 594210
-Facebook: https://www.facebook.com/profile.php?id=100066574856943
-Instagram: https://www.instagram.com/feminabeautyimpression1
-
-Provide helpful beauty tips, answer questions about our services, help with appointment booking, and give location information. Be friendly, professional, and knowledgeable about beauty and skincare."""
-
-        # Get OpenAI API key
-        openai_api_key = os.environ.get('OPENAI_API_KEY')
-        
-        if openai_api_key:
-            try:
-                from openai import OpenAI
-                client_openai = OpenAI(api_key=openai_api_key)
-                
-                response = client_openai.chat.completions.create(
-                    model="gpt-3.5-turbo",
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": chat_data.message}
-                    ],
+        doc = await db.chat_sessions.find_one({"_id": session_id}, {"turns": 1})
+    except Exception as e:
+        print(f"Session load error: {str(e)}")
+        doc = None
+    history = doc.get("turns", []) if doc else []
+    session_cache.set(session_id, history)
+    return history
+
+async def save_session_turn(session_id: str, history: List[dict], message: str, answer: str):
+    turns = [{"role": "user", "content": message}, {"role": "assistant", "content": answer}]
+    session_cache.set(session_id, (history + turns)[-SESSION_MAX_TURNS:])
+    now = datetime.utcnow()
+    try:
+        await db.chat_sessions.update_one(
+            {"_id": session_id},
+            {
+                "$push": {"turns": {"$each": turns, "$slice": -SESSION_MAX_TURNS}},
+                "$set": {"updated_at": now, "expires_at": now + timedelta(seconds=SESSION_TTL)},
+            },
+            upsert=True,
+        )
+    except Exception as e:
+        print(f"Session save error: {str(e)}")
+
+STOP_WORDS = frozenset("""
+a an the is are am was were be been do does did can could would will shall should may might
+i me my we our you your it its this that these those to of in on at for with about please
+hi hello hey thanks thank tell know want like just so and or but what whats
+""".split())
+
+def normalize_question(message: str):
+    """Case-, whitespace-, punctuation- and stop-word-insensitive form of a chat message"""
+    # Unicode-aware so Bengali, Urdu or Arabic questions keep their words; combining marks
+    # (vowel signs) are not matched by \w, so they are kept explicitly
+    text = unicodedata.normalize("NFKC", message).casefold()
+    words = "".join(
+        char if char.isalnum() or char == "£" or unicodedata.category(char).startswith("M") else " "
+        for char in text
+    ).split()
+    content_words = [word for word in words if word not in STOP_WORDS]
+    return " ".join(content_words or words)
+
+def prompt_fingerprint():
+    # Any change to the catalogue (prices, hours) or model yields new cache keys
+    return service_catalogue.fingerprint
+
+def answer_cache_key(message: str):
+    """Cache and coalescing key for a question, or None when nothing word-like is left to key on"""
+    normalized = normalize_question(message)
+    if not normalized:
+        return None
+    digest = hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+    return f"{prompt_fingerprint()}:{digest}"
+
+async def get_cached_answer(cache_key: str):
+    answer = answer_cache.get(cache_key)
+    if answer is not None:
+        answer_cache_stats["hits"] += 1
+        return answer
+    if ANSWER_CACHE_SHARED:
+        try:
+            doc = await db.chat_answer_cache.find_one(
+                {"_id": cache_key, "expires_at": {"$gt": datetime.utcnow()}}, {"answer": 1}
+            )
+        except Exception as e:
+            print(f"Answer cache lookup error: {str(e)}")
+            doc = None
+        if doc is not None:
+            answer_cache.set(cache_key, doc["answer"])
+            answer_cache_stats["shared_hits"] += 1
+            return doc["answer"]
+    answer_cache_stats["misses"] += 1
+    return None
+
+async def store_cached_answer(cache_key: str, answer: str):
+    answer_cache.set(cache_key, answer)
+    answer_cache_stats["stores"] += 1
+    if ANSWER_CACHE_SHARED:
+        now = datetime.utcnow()
+        try:
+            await db.chat_answer_cache.replace_one(
+                {"_id": cache_key},
+                {"answer": answer, "created_at": now, "expires_at": now + timedelta(seconds=ANSWER_CACHE_TTL)},
+                upsert=True,
+            )
+        except Exception as e:
+            print(f"Answer cache store error: {str(e)}")
+
+async def request_completion(message: str, history: Optional[List[dict]], cache_key: Optional[str]):
+    """Run one upstream completion under admission control, caching the answer when keyed"""
+    async with llm_admission.slot():
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            response = await asyncio.wait_for(
+                openai_client.chat.completions.create(
+                    model=OPENAI_MODEL,
+                    messages=build_chat_messages(message, history),
                     max_tokens=300,
                     temperature=0.7
-                )
-                
-                ai_response = response.choices[0].message.content
-                print(f"OpenAI response successful: {ai_response[:50]}...")
-                
-            except Exception as openai_error:
-                print(f"OpenAI API error: {str(openai_error)}")
-                # Fallback to intelligent responses based on keywords
-                ai_response = get_fallback_response(chat_data.message)
+                ),
+                timeout=OPENAI_DEADLINE,
+            )
+            outcome = "ok"
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+            raise
+        finally:
+            OPENAI_REQUEST_SECONDS.observe(time.perf_counter() - started, mode="completion", outcome=outcome)
+    ai_response = response.choices[0].message.content
+    if cache_key is not None:
+        await store_cached_answer(cache_key, ai_response)
+    return ai_response
+
+async def get_ai_response(message: str, history: Optional[List[dict]] = None, client_keys: Optional[List[str]] = None):
+    """Ask OpenAI for an answer within OPENAI_DEADLINE, falling back to keyword responses"""
+    if openai_client is None:
+        print("No OpenAI API key found, using fallback")
+        return fallback_answer(message, "no_api_key")
+    # Answers that depend on earlier turns are not reusable across sessions
+    cache_key = None if history else answer_cache_key(message)
+    if cache_key is not None:
+        cached_answer = await get_cached_answer(cache_key)
+        if cached_answer is not None:
+            CHAT_RESPONSES.inc(source="cache")
+            return cached_answer
+    # Only a call that goes upstream spends tokens; joining an identical one in flight is free
+    leads = cache_key is None or not chat_flight.in_flight(cache_key)
+    if leads and client_keys and not chat_rate_limiter.allow_all(client_keys):
+        return fallback_answer(message, "rate_limited")
+    try:
+        if cache_key is None:
+            ai_response = await request_completion(message, history, None)
         else:
-            print("No OpenAI API key found, using fallback")
-            ai_response = get_fallback_response(chat_data.message)
-        
+            ai_response = await chat_flight.do(cache_key, lambda: request_completion(message, history, cache_key))
+        CHAT_RESPONSES.inc(source="openai")
+        print(f"OpenAI response successful: {ai_response[:50]}...")
+        return ai_response
+    except LLMOverloaded as overloaded:
+        print(f"OpenAI call shed ({overloaded.reason}), using fallback")
+        reason = overloaded.reason
+    except asyncio.TimeoutError:
+        print(f"OpenAI deadline of {OPENAI_DEADLINE}s exceeded, using fallback")
+        reason = "timeout"
+    except Exception as openai_error:
+        print(f"OpenAI API error: {str(openai_error)}")
+        reason = "error"
+    # Fallback to intelligent responses based on keywords
+    return fallback_answer(message, reason)
+
+def fallback_answer(message: str, reason: str):
+    CHAT_RESPONSES.inc(source="fallback")
+    CHAT_FALLBACKS.inc(reason=reason)
+    return get_fallback_response(message)
+
+async def stream_completion(message: str, history: Optional[List[dict]], cache_key: Optional[str]):
+    """Yield deltas from one upstream streaming completion under admission control"""
+    parts = []
+    # The slot is held until the stream is drained so in-flight counts stay honest
+    async with llm_admission.slot():
+        stream = None
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            # The deadline bounds time-to-first-byte; later stalls hit the read timeout
+            stream = await asyncio.wait_for(
+                openai_client.chat.completions.create(
+                    model=OPENAI_MODEL,
+                    messages=build_chat_messages(message, history),
+                    max_tokens=300,
+                    temperature=0.7,
+                    stream=True
+                ),
+                timeout=OPENAI_DEADLINE,
+            )
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    parts.append(delta)
+                    yield delta
+            outcome = "ok"
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+            raise
+        finally:
+            OPENAI_REQUEST_SECONDS.observe(time.perf_counter() - started, mode="stream", outcome=outcome)
+            if stream is not None:
+                await stream.close()
+    if parts and cache_key is not None:
+        await store_cached_answer(cache_key, "".join(parts))
+
+async def stream_ai_response(message: str, history: Optional[List[dict]] = None, client_keys: Optional[List[str]] = None):
+    """Yield answer text as OpenAI produces it, or the fallback text as a single chunk"""
+    sent_any = False
+    reason = "no_api_key"
+    if openai_client is None:
+        print("No OpenAI API key found, using fallback")
+    else:
+        cache_key = None if history else answer_cache_key(message)
+        cached_answer = await get_cached_answer(cache_key) if cache_key is not None else None
+        if cached_answer is not None:
+            CHAT_RESPONSES.inc(source="cache")
+            yield cached_answer
+            return
+        leads = cache_key is None or not chat_flight.in_flight(cache_key, stream=True)
+        if leads and client_keys and not chat_rate_limiter.allow_all(client_keys):
+            yield fallback_answer(message, "rate_limited")
+            return
+        if cache_key is None:
+            deltas = stream_completion(message, history, None)
+        else:
+            deltas = chat_flight.stream(cache_key, lambda: stream_completion(message, history, cache_key))
+        try:
+            async for delta in deltas:
+                sent_any = True
+                yield delta
+        except LLMOverloaded as overloaded:
+            print(f"OpenAI call shed ({overloaded.reason}), using fallback")
+            reason = overloaded.reason
+        except asyncio.TimeoutError:
+            print(f"OpenAI deadline of {OPENAI_DEADLINE}s exceeded, using fallback")
+            reason = "timeout"
+        except Exception as openai_error:
+            print(f"OpenAI streaming error: {str(openai_error)}")
+            reason = "error"
+        finally:
+            await deltas.aclose()
+        if sent_any:
+            CHAT_RESPONSES.inc(source="openai")
+    if not sent_any:
+        yield fallback_answer(message, reason)
+
+def sse_event(data: dict, event: Optional[str] = None):
+    payload = f"data: {json.dumps(data)}\n\n"
+    return f"event: {event}\n{payload}" if event else payload
+
+async def chat_event_stream(message: str, session_id: str, client_keys: List[str]):
+    yield sse_event({"session_id": session_id}, "session")
+    history = await load_session_history(session_id)
+    parts = []
+    async for delta in stream_ai_response(message, history, client_keys):
+        parts.append(delta)
+        yield sse_event({"delta": delta})
+    await save_session_turn(session_id, history, message, "".join(parts))
+    yield sse_event({"session_id": session_id}, "done")
+
+def forwarded_client_address(request: Request):
+    """The client address uvicorn took from a trusted proxy's X-Forwarded-For, or None
+
+    uvicorn only rewrites the client to an X-Forwarded-For entry when the peer is in
+    FORWARDED_ALLOW_IPS; otherwise the client is the connecting peer, which is usually the ingress
+    and would put every visitor in one bucket.
+    """
+    forwarded = request.headers.get("x-forwarded-for")
+    if not forwarded or request.client is None:
+        return None
+    if request.client.host not in {host.strip() for host in forwarded.split(",")}:
+        return None
+    return request.client.host
+
+def chat_client_keys(chat_data: ChatMessage, request: Request):
+    """Rate-limit keys: the forwarded client address when trusted, plus the conversation when sent
+
+    The address bucket applies alongside the session one, so rotating session ids does not buy
+    fresh tokens. Without a trusted forwarded address there is no per-address limit.
+    """
+    client_keys = []
+    address = forwarded_client_address(request)
+    if address is not None:
+        client_keys.append(f"ip:{address}")
+    if chat_data.session_id:
+        client_keys.append(f"session:{chat_data.session_id}")
+    return client_keys
+
+def chat_stream_response(chat_data: ChatMessage, request: Request):
+    return StreamingResponse(
+        chat_event_stream(
+            chat_data.message, chat_data.session_id or str(uuid.uuid4()), chat_client_keys(chat_data, request)
+        ),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/api/services")
+async def get_services(request: Request):
+    return encoded_response(request, service_catalogue.response, {"Cache-Control": SERVICES_CACHE_CONTROL})
+
+@app.get("/api/services/{name}")
+async def lookup_service(name: str):
+    matches = service_catalogue.lookup(name)
+    if not matches:
+        raise HTTPException(status_code=404, detail="Service not found")
+    return {"query": name, "matches": matches}
+
+@app.post("/api/chat/stream")
+async def chat_stream_endpoint(chat_data: ChatMessage, request: Request):
+    return chat_stream_response(chat_data, request)
+
+@app.post("/api/chat")
+async def chat_endpoint(chat_data: ChatMessage, request: Request):
+    if "text/event-stream" in request.headers.get("accept", ""):
+        return chat_stream_response(chat_data, request)
+    session_id = chat_data.session_id or str(uuid.uuid4())
+    try:
+        history = await load_session_history(session_id)
+        ai_response = await get_ai_response(chat_data.message, history, chat_client_keys(chat_data, request))
+        await save_session_turn(session_id, history, chat_data.message, ai_response)
         return {
             "response": ai_response,
-            "session_id": chat_data.session_id or str(uuid.uuid4())
+            "session_id": session_id
         }
     except Exception as e:
         print(f"Chat error: {str(e)}")
         # Final fallback response
-        fallback_response = "Hello! I'm here to help with beauty tips and salon information. Our salon is located at 21-23 Woodgrange Road, London E7 8BA. We're open Monday-Saturday 11:00 AM to 6:00 PM. Call us at +44 7368 594210 to book an appointment!"
-        
         return {
-            "response": fallback_response,
-            "session_id": chat_data.session_id or str(uuid.uuid4())
+            "response": service_catalogue.final_response,
+            "session_id": session_id
         }
 
+def cache_metric_lines():
+    caches = {
+        "gallery_page": gallery_page_cache,
+        "image_bytes": image_bytes_cache,
+        "chat_answer": answer_cache,
+        "chat_session": session_cache,
+    }
+    lines = ["# HELP cache_requests_total In-process cache lookups", "# TYPE cache_requests_total counter"]
+    for name, cache in caches.items():
+        lines.append(f'cache_requests_total{{cache="{name}",result="hit"}} {cache.hits}')
+        lines.append(f'cache_requests_total{{cache="{name}",result="miss"}} {cache.misses}')
+    lines.append(f'cache_requests_total{{cache="chat_answer_shared",result="hit"}} {answer_cache_stats["shared_hits"]}')
+    lines += ["# HELP cache_entries Entries held per in-process cache", "# TYPE cache_entries gauge"]
+    lines += [f'cache_entries{{cache="{name}"}} {len(cache)}' for name, cache in caches.items()]
+    lines += ["# HELP cache_bytes Bytes held by size-bounded caches", "# TYPE cache_bytes gauge"]
+    lines.append(f'cache_bytes{{cache="image_bytes"}} {image_bytes_cache.current_bytes}')
+    lines += ["# HELP singleflight_calls_total Calls that ran (leader) or joined an identical in-flight call (follower)",
+              "# TYPE singleflight_calls_total counter"]
+    for name, flight in (("gallery", gallery_flight), ("chat", chat_flight)):
+        lines.append(f'singleflight_calls_total{{flight="{name}",role="leader"}} {flight.leaders}')
+        lines.append(f'singleflight_calls_total{{flight="{name}",role="follower"}} {flight.followers}')
+    return lines
+
+def admission_metric_lines():
+    lines = [
+        "# HELP chat_llm_in_flight Upstream LLM calls currently running", "# TYPE chat_llm_in_flight gauge",
+        f"chat_llm_in_flight {llm_admission.in_flight}",
+        "# HELP chat_llm_queue_depth Chat requests waiting for an LLM slot", "# TYPE chat_llm_queue_depth gauge",
+        f"chat_llm_queue_depth {llm_admission.waiting}",
+        "# HELP chat_llm_admitted_total LLM calls admitted", "# TYPE chat_llm_admitted_total counter",
+        f"chat_llm_admitted_total {llm_admission.admitted}",
+        "# HELP chat_llm_shed_total Chat requests shed to the fallback", "# TYPE chat_llm_shed_total counter",
+    ]
+    lines += [f'chat_llm_shed_total{{reason="{reason}"}} {count}' for reason, count in llm_admission.shed.items()]
+    lines.append(f'chat_llm_shed_total{{reason="rate_limited"}} {chat_rate_limiter.limited}')
+    return lines
+
+def worker_metric_lines():
+    lines = []
+    for metric in (
+        HTTP_REQUEST_SECONDS, HTTP_REQUEST_BYTES, HTTP_RESPONSE_BYTES, MONGO_COMMAND_SECONDS,
+        OPENAI_REQUEST_SECONDS, GALLERY_SERIALIZE_SECONDS, CHAT_RESPONSES, CHAT_FALLBACKS,
+    ):
+        lines.extend(metric.render())
+    lines.extend(cache_metric_lines())
+    lines.extend(admission_metric_lines())
+    lines.extend(startup_metric_lines())
+    return lines
+
+@app.get("/api/metrics")
+async def metrics_endpoint():
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics disabled")
+    if METRICS_MULTIPROC_DIR:
+        # Every worker's series carry a worker label; aggregate with sum without (worker)
+        write_worker_metrics(METRICS_MULTIPROC_DIR, worker_metric_lines())
+        lines = merged_metric_lines(METRICS_MULTIPROC_DIR)
+    else:
+        lines = worker_metric_lines()
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
+@app.get("/api/admin/profile")
+async def profile_endpoint(top: int = Query(20, ge=1, le=200), reset: bool = False, username: str = Depends(verify_token)):
+    if PROFILER_SAMPLE_INTERVAL <= 0:
+        raise HTTPException(status_code=404, detail="Profiler disabled; set PROFILER_SAMPLE_INTERVAL")
+    report = {"interval_s": PROFILER_SAMPLE_INTERVAL, "samples": stack_sampler.total, "stacks": stack_sampler.top(top)}
+    if reset:
+        stack_sampler.reset()
+    return report
+
+@app.get("/api/admin/chat-cache")
+async def chat_cache_stats(username: str = Depends(verify_token)):
+    return {
+        **answer_cache_stats,
+        "entries": len(answer_cache),
+        "prompt_fingerprint": prompt_fingerprint(),
+        "shared": ANSWER_CACHE_SHARED,
+        "admission": {
+            "in_flight": llm_admission.in_flight,
+            "queue_depth": llm_admission.waiting,
+            "admitted": llm_admission.admitted,
+            "shed": {**llm_admission.shed, "rate_limited": chat_rate_limiter.limited},
+        },
+    }
+
+# Intents whose answer is already covered when a more specific intent matches
+GENERIC_INTENTS = {"price"}
+FALLBACK_MAX_INTENTS = int(os.environ.get('FALLBACK_MAX_INTENTS', 2))
+FALLBACK_CACHE_SIZE = int(os.environ.get('FALLBACK_CACHE_SIZE', 1024))
+
+def stem_word(word: str):
+    """Light English stemmer: closed/closing/close -> clos, trimming -> trim, parties -> party"""
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    for suffix in ("ing", "ed", "es", "s"):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3 and not word.endswith("ss"):
+            word = word[:-len(suffix)]
+            # "trimm" -> "trim", "wedd" -> "wed"; "ll"/"ss"/"zz" are part of the stem ("filling")
+            if suffix in ("ing", "ed") and len(word) > 3 and word[-1] == word[-2] and word[-1] not in "aeiouslz":
+                word = word[:-1]
+            break
+    # Dropping a final "e" lets "close" meet "closing" and "price" meet "pricing"
+    if len(word) > 3 and word.endswith("e"):
+        word = word[:-1]
+    return word
+
+INFLECTION_SUFFIXES = ("", "e", "es", "s", "ed", "ing", "ings", "er", "ers")
+
+def inflections(stem: str):
+    """Surface forms a stem stands for: clos -> close/closed/closing, trim -> trimming, party -> parties"""
+    if stem.endswith("y"):
+        return {stem, stem[:-1] + "ies", stem[:-1] + "ied"}
+    bases = {stem, stem + stem[-1]} if stem[-1] not in "aeiouy" else {stem}
+    return {base + suffix for base in bases for suffix in INFLECTION_SUFFIXES}
+
+class IntentMatcher:
+    """Single-pass keyword matcher: every inflected keyword form is precomputed into one lookup table"""
+
+    # Lowercases ASCII letters and blanks out ASCII punctuation and digits in one bytes.translate;
+    # UTF-8 bytes of other scripts are kept so their words never match
+    WORD_BYTES = bytes(
+        byte if byte >= 0x80 else byte | 0x20 if chr(byte).isalpha() else 0x20 for byte in range(256)
+    )
+
+    def __init__(self, intents, max_rankings: int = 4096):
+        self.names = [name for name, _, _ in intents]
+        self.answers = {name: answer for name, _, answer in intents}
+        # Every stemmed keyword (or two-word phrase) maps straight to {intent order: weight}
+        self.lookup = {}
+        for order, (name, weights, _) in enumerate(intents):
+            for keyword, weight in weights.items():
+                hits = self.lookup.setdefault(" ".join(map(stem_word, keyword.split())), {})
+                hits[order] = max(hits.get(order, 0), weight)
+        # Message words are looked up as written, so nothing is stemmed per request
+        self.forms = {}
+        self.phrases = {}
+        for form in self.lookup:
+            words = form.split()
+            if len(words) == 1:
+                for surface in inflections(form):
+                    self.forms.setdefault(surface.encode(), form)
+            else:
+                for first in inflections(words[0]):
+                    for second in inflections(words[1]):
+                        self.phrases.setdefault((first.encode(), second.encode()), form)
+        self.vocabulary = frozenset(self.forms)
+        self.phrase_pairs = frozenset(self.phrases)
+        self.phrase_starts = frozenset(first for first, _ in self.phrases)
+        # Rankings and replies per set of matched forms, so paraphrases that hit the same
+        # keywords share them; bounded because the sets come from user text
+        self.rankings = {}
+        self.replies = {}
+        self.max_rankings = max_rankings
+
+    def matched_forms(self, message: str):
+        """The keyword forms a message contains, as a frozenset"""
+        # translate, split and the set intersections run in C; only hits reach Python code
+        words = message.encode().translate(self.WORD_BYTES).split()
+        found = frozenset(map(self.forms.__getitem__, self.vocabulary.intersection(words)))
+        if not self.phrase_starts.isdisjoint(words):
+            pairs = self.phrase_pairs.intersection(zip(words, words[1:]))
+            if pairs:
+                # Two-word phrases such as "party lashes" take precedence over their first word
+                found = found.difference(map(self.forms.get, (first for first, _ in pairs)))
+                found = found.union(map(self.phrases.__getitem__, pairs))
+        return found
+
+    def rank(self, message: str):
+        """Return [(intent, score)] for every matched intent, best first"""
+        return list(self._ranking(self.matched_forms(message)))
+
+    def respond(self, message: str, max_intents: int = 1):
+        key = (self.matched_forms(message), max_intents)
+        if key in self.replies:
+            return self.replies[key]
+        reply = self._reply(self._ranking(key[0]), max_intents)
+        if len(self.replies) < self.max_rankings:
+            self.replies[key] = reply
+        return reply
+
+    def _ranking(self, found):
+        ranking = self.rankings.get(found)
+        if ranking is None:
+            scores = {}
+            for form in found:
+                for order, weight in self.lookup[form].items():
+                    scores[order] = scores.get(order, 0) + weight
+            ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+            ranking = tuple((self.names[order], score) for order, score in ranked)
+            if len(self.rankings) < self.max_rankings:
+                self.rankings[found] = ranking
+        return ranking
+
+    def _reply(self, ranked, max_intents: int):
+        if not ranked:
+            return None
+        if len(ranked) == 1 or max_intents == 1:
+            return self.answers[ranked[0][0]]
+        top_score = ranked[0][1]
+        selected = [name for name, score in ranked if score * 2 >= top_score][:max_intents]
+        if len(selected) > 1:
+            selected = [name for name in selected if name not in GENERIC_INTENTS] or selected[:1]
+        return " ".join(self.answers[name] for name in selected)
+
+@functools.lru_cache(maxsize=FALLBACK_CACHE_SIZE)
 def get_fallback_response(message: str):
     """Provide intelligent fallback responses based on keywords"""
-    message_lower = message.lower()
-    
-    if any(word in message_lower for word in ['hour', 'time', 'open', 'close']):
-        return "Our opening hours are Monday to Saturday, 11:00 AM to 6:00 PM. We also offer appointments from 10:00-11:00 AM and 6:00-7:00 PM by special arrangement. Call us at +44 7368 594210 to book!"
-    
-    elif any(word in message_lower for word in ['threading', 'eyebrow', 'thread']):
-        return "We offer comprehensive threading services: Eye Brow (£5), Upper Lip (£3), Chin (£3), Forehead (£3), Neck (£3), Side Face (£5), and Full Face (£15). Our experienced technicians ensure precise and comfortable threading!"
-    
-    elif any(word in message_lower for word in ['wax', 'waxing']):
-        return "We provide both face and body waxing services. Face waxing: Full Face (£18), individual areas from £4-£6. Body waxing: Full Leg (£25), Half Leg (£15), Full Arm (£18), Under Arm (£8), Full Body except bikini (£60)."
-    
-    elif any(word in message_lower for word in ['manicure', 'pedicure', 'nail']):
-        return "Our nail services include professional Manicure (£20) and Pedicure (£25). We use high-quality products and techniques to keep your nails healthy and beautiful!"
-    
-    elif any(word in message_lower for word in ['facial', 'massage', 'spa']):
-        return "We offer various facial treatments: Mini Facial (£15), Full Facial with cleansing/whitening/gold options (£25), Herbal Facial (£30), and Head Massage with or without herbal oil (£15). Perfect for relaxation and skin care!"
-    
-    elif any(word in message_lower for word in ['makeup', 'bridal', 'party']):
-        return "Our makeup services include Party Makeup (from £30) and Bridal Makeup (from £150). We create stunning looks for your special occasions using professional techniques and premium products!"
-    
-    elif any(word in message_lower for word in ['henna', 'hair', 'cut']):
-        return "We offer henna artistry and hair services: One Hand/Foot Henna (from £5), Both Hands/Feet (from £10), Hair Trimming (£7), Other cuts (from £12), and special rates for children under 10 (£10)."
-    
-    elif any(word in message_lower for word in ['location', 'address', 'where', 'find']):
-        return "We're located at 21-23 Woodgrange Road, London E7 8BA (Inside Post Office). Easy to find and accessible by public transport. Call +44 7368 594210 for directions or to book an appointment!"
-    
-    elif any(word in message_lower for word in ['price', 'cost', 'how much']):
-        return "Our prices range from £3 for individual threading services to £150 for bridal makeup. We offer competitive pricing for all beauty services. Would you like to know about specific treatments?"
-    
-    elif any(word in message_lower for word in ['book', 'appointment', 'schedule']):
-        return "To book an appointment, please call us at +44 7368 594210. We're open Monday-Saturday 11:00 AM to 6:00 PM, with special appointment slots available 10:00-11:00 AM and 6:00-7:00 PM."
-    
-    else:
-        return "Hello! I'm your beauty assistant at Femina Beauty Impression. I can help you with information about our services including threading, waxing, facials, manicure/pedicure, makeup, and henna. We're located at 21-23 Woodgrange Road, London E7 8BA. How can I help you today?"
+    return service_catalogue.matcher.respond(message, FALLBACK_MAX_INTENTS) or service_catalogue.default_response
+
+def normalize_service_name(name: str):
+    return " ".join(re.findall(r"[a-z0-9]+", name.lower()))
+
+def format_amount(amount: float):
+    return f"£{amount:.2f}" if amount % 1 else f"£{amount:.0f}"
+
+def format_price(service: dict, capitalize: bool = False):
+    price = format_amount(service["price"])
+    if service.get("from"):
+        return f"{'From' if capitalize else 'from'} {price}"
+    return price
+
+class ServiceCatalogue:
+    """Salon data plus everything derived from it, built once per catalogue version"""
+
+    def __init__(self, data: dict):
+        self.data = data
+        salon = data["salon"]
+        self.categories = {category["id"]: category for category in data["categories"]}
+
+        # Every service reachable by its name, its aliases or "<category> <name>"
+        self.index = {}
+        for category in data["categories"]:
+            for service in category["services"]:
+                entry = {
+                    "category": category["id"],
+                    "category_name": category["name"],
+                    "name": service["name"],
+                    "price": service["price"],
+                    "price_from": bool(service.get("from")),
+                    "price_label": format_price(service, capitalize=True),
+                }
+                keys = {service["name"], f"{category['name']} {service['name']}", *service.get("aliases", [])}
+                for key in {normalize_service_name(key) for key in keys}:
+                    self.index.setdefault(key, []).append(entry)
+
+        services = [entry for category in data["categories"] for entry in category["services"]]
+        cheapest = min(services, key=lambda service: service["price"])
+        priciest = max(services, key=lambda service: service["price"])
+        fields = {
+            **salon,
+            "min_price": format_amount(cheapest["price"]), "min_service": cheapest["name"],
+            "max_price": format_amount(priciest["price"]), "max_service": priciest["name"],
+        }
+
+        intents = []
+        for intent in data["intents"]:
+            listed = [self.categories[category_id] for category_id in intent.get("categories", [])]
+            if len(listed) == 1:
+                services_text = self.list_services(listed[0])
+            else:
+                services_text = ". ".join(f"{category['name']}: {self.list_services(category)}" for category in listed)
+            intents.append((intent["name"], intent["keywords"], intent["answer"].format(**fields, services=services_text)))
+        self.matcher = IntentMatcher(intents)
+        self.default_response = data["greeting"].format(**fields)
+        self.final_response = data["final_fallback"].format(**fields)
+
+        price_lines = "\n".join(
+            f"{category['name'].upper()}: "
+            + ", ".join(f"{service['name']} ({format_price(service, capitalize=True)})" for service in category["services"])
+            for category in data["categories"]
+        )
+        self.system_prompt = (
+            f"{data['prompt']['intro'].format(**fields)}\n\n"
+            f"Our services and pricing:\n{price_lines}\n\n"
+            f"Opening Hours: {salon['hours']}\n"
+            f"Special appointments: {salon['special_hours']} by appointment only\n"
+            f"Phone: {salon['phone']}\n"
+            f"Facebook: {salon['facebook']}\n"
+            f"Instagram: {salon['instagram']}\n\n"
+            f"{data['prompt']['closing']}"
+        )
+
+        self.response = EncodedBody(dump_json(
+            {"salon": salon, "categories": [
+                {"id": category["id"], "name": category["name"], "services": [
+                    {
+                        "name": service["name"],
+                        "price": service["price"],
+                        "price_from": bool(service.get("from")),
+                        "price_label": format_price(service, capitalize=True),
+                        "aliases": service.get("aliases", []),
+                    }
+                    for service in category["services"]
+                ]}
+                for category in data["categories"]
+            ]}
+        ))
+        self.version = self.response.etag.strip('"')
+        self.fingerprint = hashlib.sha256(f"{OPENAI_MODEL}\n{self.system_prompt}".encode("utf-8")).hexdigest()[:16]
+
+    @staticmethod
+    def list_services(category: dict):
+        return ", ".join(f"{service['name']} ({format_price(service)})" for service in category["services"])
+
+    def lookup(self, name: str):
+        return self.index.get(normalize_service_name(name), [])
+
+def load_service_catalogue(path: str = SERVICE_CATALOGUE_PATH):
+    """Read the catalogue file and swap in everything derived from it"""
+    global service_catalogue
+    with open(path, encoding="utf-8") as catalogue_file:
+        service_catalogue = ServiceCatalogue(json.load(catalogue_file))
+    # Memoized fallback answers belong to the previous catalogue version
+    get_fallback_response.cache_clear()
+    print(f"Loaded service catalogue {service_catalogue.version} ({len(service_catalogue.index)} lookup keys)")
+    return service_catalogue
+
+service_catalogue = None
+load_service_catalogue()
+
+async def migrate_gallery_to_gridfs():
+    """Move legacy inline base64 documents into GridFS and register every image as a content-addressed blob"""
+    connect_mongo()
+    migrated = 0
+    cursor = db.gallery.find({"digest": {"$exists": False}})
+    async for image in cursor:
+        derivatives = image.get("derivatives")
+        if image.get("file_id") is None:
+            if not image.get("image_data"):
+                print(f"Skipping {image['id']}: no image data")
+                continue
+            data = base64.b64decode(image["image_data"])
+            content_type = guess_content_type(image.get("filename"))
+            file_id = await gallery_fs.upload_from_stream(
+                image.get("filename") or image["id"],
+                data,
+                metadata={"contentType": content_type},
+            )
+        else:
+            # Uploaded to GridFS before content addressing; hash the stored bytes
+            file_id = image["file_id"]
+            grid_out = await gallery_fs.open_download_stream(file_id)
+            data = await grid_out.read()
+            content_type = image.get("content_type") or guess_content_type(image.get("filename"))
+        digest = hashlib.sha256(data).hexdigest()
+        blob = await acquire_blob(digest, file_id, len(data), content_type, derivatives)
+
+        update = {"$set": {"digest": digest, "file_id": blob["file_id"], "content_type": blob["content_type"], "size": len(data)}, "$unset": {"image_data": ""}}
+        if blob["file_id"] != file_id:
+            # Duplicate of an image already migrated: point at the shared bytes and drop this copy
+            await delete_grid_files([file_id] + [d["file_id"] for d in derivatives or []])
+            if blob.get("derivatives") is not None:
+                update["$set"]["derivatives"] = blob["derivatives"]
+            else:
+                update["$unset"]["derivatives"] = ""
+        await db.gallery.update_one({"_id": image["_id"]}, update)
+        migrated += 1
+        print(f"Migrated gallery image {image['id']} ({len(data)} bytes, sha256 {digest[:12]})")
+    await publish_gallery_change()
+    print(f"Migration complete: {migrated} image(s) stored in GridFS by content digest")
+    return migrated
+
+async def backfill_derivatives():
+    """Generate responsive derivatives for gallery images that do not have them yet"""
+    connect_mongo()
+    generated = 0
+    cursor = db.gallery.find(
+        # An empty list is a finished render of an image narrower than every derivative width
+        {"file_id": {"$exists": True}, "derivatives": {"$exists": False}},
+        {"id": 1, "filename": 1, "file_id": 1, "digest": 1},
+    )
+    async for image in cursor:
+        digest = image.get("digest")
+        blob = await db.image_blobs.find_one({"_id": digest}) if digest else None
+        if blob is not None and blob.get("derivatives") is not None:
+            derivatives = blob["derivatives"]
+        else:
+            try:
+                grid_out = await gallery_fs.open_download_stream(image["file_id"])
+                derivatives = await create_derivatives(image["id"], image.get("filename"), grid_out)
+            except Exception as e:
+                print(f"Skipping {image['id']}: {str(e)}")
+                continue
+            generated += 1
+            if blob is not None:
+                await db.image_blobs.update_one({"_id": digest}, {"$set": {"derivatives": derivatives}})
+        # Every gallery entry sharing these bytes gets the same derivatives
+        image_filter = {"digest": digest} if digest else {"_id": image["_id"]}
+        await db.gallery.update_many(image_filter, {"$set": {"derivatives": derivatives}})
+        print(f"{len(derivatives)} derivative(s) for {image['id']}")
+    await publish_gallery_change()
+    print(f"Backfill complete: {generated} image(s) rendered")
+    return generated
+
+def start_openai_client():
+    global openai_client
+    openai_api_key = os.environ.get('OPENAI_API_KEY')
+    if openai_api_key and openai_client is None:
+        # Imported here: the SDK is the slowest import and unused without a key
+        import httpx
+        from openai import AsyncOpenAI
+
+        # One pooled HTTP client shared by every chat request on this worker
+        openai_client = AsyncOpenAI(
+            api_key=openai_api_key,
+            timeout=httpx.Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+            max_retries=OPENAI_MAX_RETRIES,
+            http_client=httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=OPENAI_MAX_CONNECTIONS,
+                    max_keepalive_connections=OPENAI_MAX_CONNECTIONS,
+                ),
+                timeout=httpx.Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+            ),
+        )
+
+async def close_openai_client():
+    global openai_client
+    if openai_client is not None:
+        await openai_client.close()
+        openai_client = None
+
+def shutdown_derivative_pool():
+    global derivative_pool
+    if derivative_pool is not None:
+        derivative_pool.shutdown(wait=False, cancel_futures=True)
+        derivative_pool = None
+
+startup_timings["import"] = time.perf_counter() - IMPORT_STARTED
+
+# Run as a script (or re-imported by a spawned worker), this module is also the `server` that
+# launcher and pickled derivative jobs import, so it is only loaded once per process
+if __name__ in ("__main__", "__mp_main__"):
+    sys.modules.setdefault("server", sys.modules[__name__])
 
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
+    if len(sys.argv) > 1 and sys.argv[1] == "migrate-gridfs":
+        asyncio.run(migrate_gallery_to_gridfs())
+    elif len(sys.argv) > 1 and sys.argv[1] == "backfill-derivatives":
+        asyncio.run(backfill_derivatives())
+    else:
+        from launcher import serve
+
+        serve()
\ No newline at end of file
@@ -0,0 +1,118 @@
+"""Micro-benchmark: compiled fallback intent matcher vs the original if/elif keyword chain.
+
+"cold" calls the matcher directly, which still shares rankings between messages that hit the
+same keyword forms; "memoized" goes through get_fallback_response, whose LRU makes repeated
+questions a dictionary lookup. The run ends with routing checks for inflected keyword forms and
+exits non-zero if any fails. Run from the repository root:
+
+    python benchmarks/fallback_matcher.py [--number 20000]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from server import get_fallback_response, service_catalogue  # noqa: E402
+
+fallback_matcher = service_catalogue.matcher
+
+
+def legacy_fallback_response(message: str):
+    """The original get_fallback_response keyword chain, kept here for comparison"""
+    message_lower = message.lower()
+    if any(word in message_lower for word in ['hour', 'time', 'open', 'close']):
+        return "hours"
+    elif any(word in message_lower for word in ['threading', 'eyebrow', 'thread']):
+        return "threading"
+    elif any(word in message_lower for word in ['wax', 'waxing']):
+        return "waxing"
+    elif any(word in message_lower for word in ['manicure', 'pedicure', 'nail']):
+        return "nails"
+    elif any(word in message_lower for word in ['facial', 'massage', 'spa']):
+        return "facial"
+    elif any(word in message_lower for word in ['makeup', 'bridal', 'party']):
+        return "makeup"
+    elif any(word in message_lower for word in ['henna', 'hair', 'cut']):
+        return "henna_hair"
+    elif any(word in message_lower for word in ['location', 'address', 'where', 'find']):
+        return "location"
+    elif any(word in message_lower for word in ['price', 'cost', 'how much']):
+        return "price"
+    elif any(word in message_lower for word in ['book', 'appointment', 'schedule']):
+        return "booking"
+    else:
+        return None
+
+
+MESSAGES = [
+    "What are your opening hours on Saturday?",
+    "How much is eyebrow threading?",
+    "Do you do party lashes?",
+    "I need bridal makeup for my wedding in June, what does it cost?",
+    "Can I book a pedicure and a manicure for tomorrow?",
+    "Where are you located?",
+    "hello",
+    "Do you have space for a herbal facial and head massage this afternoon?",
+    "How much for a full leg wax?",
+    "Is there a discount for children's haircuts?",
+    "Are you closing early today?",
+    "How much is hair trimming?",
+    "What are your timings on Sunday?",
+    "Do you do weddings?",
+    "I'd like to know about the prices of henna for both hands for a party next week please, "
+    "and whether I need an appointment or can just walk in at any time during the day",
+]
+
+# Expected top intent for inflected forms a suffix-stripping stemmer used to miss
+ROUTING_CHECKS = {
+    "What are your timings on Sunday?": "hours",
+    "Any openings this week?": "hours",
+    "Are you closing early today?": "hours",
+    "When are you closed?": "hours",
+    "Do you do weddings?": "makeup",
+    "Are bookings needed for threading?": "threading",
+    "Are bookings needed?": "booking",
+    "How much is hair trimming?": "henna_hair",
+    "Do you do party lashes?": "lashes",
+    "Any offers for parties?": "makeup",
+    "Eyebrows shaped?": "threading",
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=20000, help="calls per message set")
+    args = parser.parse_args()
+
+    variants = (
+        ("legacy if/elif", legacy_fallback_response),
+        ("matcher (cold)", lambda m: fallback_matcher.respond(m, 2)),
+        ("matcher (memoized)", get_fallback_response),
+    )
+    for name, func in variants:
+        seconds = timeit.timeit(lambda: [func(m) for m in MESSAGES], number=args.number)
+        per_call_us = seconds / (args.number * len(MESSAGES)) * 1e6
+        print(f"{name:>20}: {per_call_us:8.2f} us/call")
+
+    print("\nRouting differences (legacy -> ranked intents):")
+    for message in MESSAGES:
+        legacy = legacy_fallback_response(message)
+        ranked = fallback_matcher.rank(message)
+        top = ranked[0][0] if ranked else None
+        marker = " " if legacy == top else "*"
+        print(f" {marker} {message[:60]!r}: {legacy} -> {ranked}")
+
+    failures = 0
+    for message, expected in ROUTING_CHECKS.items():
+        ranked = fallback_matcher.rank(message)
+        if not ranked or ranked[0][0] != expected:
+            failures += 1
+            print(f"Routing check failed: {message!r} should reach {expected}, got {ranked}")
+    print(f"\nRouting checks: {len(ROUTING_CHECKS) - failures}/{len(ROUTING_CHECKS)} passed")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
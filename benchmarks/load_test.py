@@ -0,0 +1,448 @@
+"""Hermetic load test for the backend API.
+
+Runs the FastAPI ``app`` in-process against an in-memory Mongo stand-in (mongomock-motor plus a
+small GridFS bucket replacement) and a local fake OpenAI HTTP server with configurable latency.
+Nothing touches the network, so it runs on a plain Linux box. Run from the repository root:
+
+    python benchmarks/load_test.py --concurrency 1,10,50 --gallery-sizes 10,100 --output results.json
+    python benchmarks/load_test.py --compare old.json --output new.json
+
+Pass ``--mongo-url`` to measure against a real local mongod instead of the stand-in.
+
+A chat answer served by the keyword fallback (admission control shedding, upstream errors or
+timeouts) still returns 200, so each run also reports how many answers were fallbacks and why,
+read from the server's chat_fallback_total counter. Raise ``LLM_MAX_CONCURRENCY`` and
+``LLM_QUEUE_SIZE`` in the environment to measure the upstream path without shedding.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import itertools
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "backend"))
+sys.path.insert(0, ROOT)
+
+import httpx  # noqa: E402
+
+from tests.memory_gridfs import InMemoryGridFSBucket  # noqa: E402
+
+SCENARIOS = ("gallery_list", "gallery_list_uncached", "gallery_upload", "chat", "chat_cached", "fallback")
+
+CHAT_QUESTIONS = [
+    "What are your opening hours?",
+    "How much is eyebrow threading?",
+    "Do you do party lashes?",
+    "Where are you located?",
+    "Can I book a pedicure for Saturday?",
+]
+
+
+class FakeOpenAIServer:
+    """Minimal HTTP/1.1 server answering /v1/chat/completions after a fixed delay"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.requests = 0
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        host, port = self._server.sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}/v1"
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                length = 0
+                for line in head.decode("latin-1").split("\r\n")[1:]:
+                    name, _, value = line.partition(":")
+                    if name.strip().lower() == "content-length":
+                        length = int(value.strip())
+                body = json.loads(await reader.readexactly(length) or b"{}")
+                self.requests += 1
+                await asyncio.sleep(self.latency)
+                if body.get("stream"):
+                    await self._send_stream(writer)
+                else:
+                    await self._send_completion(writer)
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+    async def _send_completion(self, writer):
+        payload = json.dumps({
+            "id": "chatcmpl-bench",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": "bench",
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "We are open Monday to Saturday, 11 AM to 6 PM."},
+                "finish_reason": "stop",
+            }],
+        }).encode()
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+            + f"Content-Length: {len(payload)}\r\n\r\n".encode()
+            + payload
+        )
+        await writer.drain()
+
+    async def _send_stream(self, writer):
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nTransfer-Encoding: chunked\r\n\r\n")
+        tokens = ["We are open ", "Monday to Saturday, ", "11 AM to 6 PM."]
+        events = [
+            json.dumps({
+                "id": "chatcmpl-bench",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": "bench",
+                "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}],
+            })
+            for token in tokens
+        ] + ["[DONE]"]
+        for event in events:
+            data = f"data: {event}\n\n".encode()
+            writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            await writer.drain()
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+
+def sample_jpeg(width: int = 1200, height: int = 800):
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), (220, 120, 160)).save(buffer, "JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(int(round(fraction * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def current_rss_mb():
+    """Resident set size right now, from /proc; None where /proc is unavailable"""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+class RssSampler:
+    """Peak resident set size while a scenario runs, sampled from a background thread
+
+    ru_maxrss is the peak over the whole process lifetime, so every scenario after the heaviest
+    one would report that scenario's peak. It is only used where /proc is unavailable.
+    """
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.peak = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+
+    def _run(self):
+        while True:
+            rss = current_rss_mb()
+            if rss is None:
+                return
+            self.peak = max(self.peak, rss)
+            if self._stop.wait(self.interval):
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+    @property
+    def peak_mb(self):
+        if self.peak:
+            return self.peak
+        # ru_maxrss is reported in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def drive(operation, requests: int, concurrency: int):
+    """Run `operation(i)` `requests` times with `concurrency` workers and summarize latencies"""
+    counter = itertools.count()
+    latencies = []
+    errors = 0
+
+    async def worker():
+        nonlocal errors
+        while True:
+            i = next(counter)
+            if i >= requests:
+                return
+            started = time.perf_counter()
+            try:
+                ok = await operation(i)
+            except Exception:
+                ok = False
+            latencies.append(time.perf_counter() - started)
+            if not ok:
+                errors += 1
+
+    with RssSampler() as rss:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": requests,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 4),
+        "throughput_rps": round(requests / elapsed, 2) if elapsed else None,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "max_ms": round(latencies[-1] * 1000, 3),
+        "peak_rss_mb": round(rss.peak_mb, 1),
+    }
+
+
+def fallback_counts(server):
+    """Keyword-fallback answers served so far, by reason; a fallback still returns 200"""
+    return {reason: count for (reason,), count in server.CHAT_FALLBACKS.values.items()}
+
+
+async def seed_gallery(server, size: int):
+    await server.db.gallery.delete_many({})
+    now = datetime.utcnow()
+    documents = [
+        {
+            "id": f"bench-{i:06d}",
+            "filename": f"bench-{i}.jpg",
+            "digest": f"{i:064x}",
+            "file_id": i,
+            "content_type": "image/jpeg",
+            "size": 150000,
+            "derivatives": [
+                {"width": width, "height": width * 2 // 3, "content_type": "image/webp", "size": width * 40, "file_id": i}
+                for width in (320, 800, 1600)
+            ],
+            "description": f"Benchmark image {i}",
+            "uploaded_at": now - timedelta(seconds=i),
+        }
+        for i in range(size)
+    ]
+    await server.db.image_blobs.delete_many({})
+    if documents:
+        await server.db.gallery.insert_many(documents)
+    server.invalidate_gallery()
+
+
+async def run(args):
+    os.environ["OPENAI_API_KEY"] = "bench"
+    fake_openai = FakeOpenAIServer(args.openai_latency)
+    os.environ["OPENAI_BASE_URL"] = await fake_openai.start()
+    # Every request comes from one simulated client; admission control stays on, the per-client bucket does not
+    os.environ.setdefault("CHAT_RATE_PER_SECOND", "0")
+
+    import server
+
+    if args.mongo_url:
+        server.MONGO_URL = args.mongo_url
+    else:
+        from mongomock_motor import AsyncMongoMockClient
+
+        # Pre-populate the globals connect_mongo() would set so the lifespan keeps the stand-ins
+        server.client = AsyncMongoMockClient()
+        server.db = server.client.beauty_salon_bench
+        server.gallery_fs = InMemoryGridFSBucket()
+    server.ANSWER_CACHE_SHARED = False
+
+    token = server.create_access_token({"sub": server.DEFAULT_ADMIN["username"]})
+    auth = {"Authorization": f"Bearer {token}"}
+    upload_body = sample_jpeg()
+    upload_counter = itertools.count()
+    results = []
+
+    async with server.app.router.lifespan_context(server.app):
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+
+            async def gallery_list(i):
+                response = await client.get("/api/gallery", params={"limit": args.page_size})
+                return response.status_code == 200
+
+            async def gallery_upload(i):
+                # Trailing bytes after the JPEG end marker keep every digest unique without breaking decoding
+                body = upload_body + f"bench-{next(upload_counter)}".encode()
+                response = await client.post(
+                    "/api/gallery",
+                    files={"file": (f"upload-{i}.jpg", body, "image/jpeg")},
+                    data={"description": f"upload {i}"},
+                    headers=auth,
+                )
+                return response.status_code == 200
+
+            async def chat(i):
+                # Unique text per request so every call reaches the fake upstream
+                message = f"{CHAT_QUESTIONS[i % len(CHAT_QUESTIONS)]} (request {i})"
+                response = await client.post("/api/chat", json={"message": message})
+                return response.status_code == 200
+
+            async def chat_cached(i):
+                response = await client.post("/api/chat", json={"message": CHAT_QUESTIONS[i % len(CHAT_QUESTIONS)]})
+                return response.status_code == 200
+
+            async def fallback(i):
+                server.get_fallback_response.__wrapped__(CHAT_QUESTIONS[i % len(CHAT_QUESTIONS)])
+                return True
+
+            operations = {
+                "gallery_list": gallery_list,
+                "gallery_list_uncached": gallery_list,
+                "gallery_upload": gallery_upload,
+                "chat": chat,
+                "chat_cached": chat_cached,
+                "fallback": fallback,
+            }
+            page_cache_entries = server.gallery_page_cache.max_entries
+
+            for scenario in args.scenarios:
+                sizes = args.gallery_sizes if scenario.startswith("gallery") else [None]
+                for size in sizes:
+                    for concurrency in args.concurrency:
+                        if size is not None:
+                            await seed_gallery(server, size)
+                        server.answer_cache.clear()
+                        server.session_cache.clear()
+                        server.gallery_page_cache.max_entries = 0 if scenario == "gallery_list_uncached" else page_cache_entries
+                        requests = args.requests if scenario != "gallery_upload" else min(args.requests, args.max_uploads)
+                        fallbacks_before = fallback_counts(server)
+                        # The server logs every request with print(); keep that out of the report
+                        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                            summary = await drive(operations[scenario], requests, concurrency)
+                        fallbacks = {
+                            reason: count - fallbacks_before.get(reason, 0)
+                            for reason, count in fallback_counts(server).items()
+                            if count > fallbacks_before.get(reason, 0)
+                        }
+                        summary.update(
+                            scenario=scenario, concurrency=concurrency, gallery_size=size,
+                            fallbacks=sum(fallbacks.values()), fallback_reasons=fallbacks,
+                        )
+                        results.append(summary)
+                        print(format_result(summary), flush=True)
+            server.gallery_page_cache.max_entries = page_cache_entries
+
+    await fake_openai.stop()
+    return results
+
+
+def format_result(result):
+    size = f" n={result['gallery_size']}" if result.get("gallery_size") is not None else ""
+    return (
+        f"{result['scenario']:<22} c={result['concurrency']:<4}{size:<8} "
+        f"{result['throughput_rps']:>9} req/s  p50 {result['p50_ms']:>8} ms  "
+        f"p95 {result['p95_ms']:>8} ms  p99 {result['p99_ms']:>8} ms  "
+        f"errors {result['errors']:<4} fallbacks {result.get('fallbacks', 0):<4} rss {result['peak_rss_mb']} MB"
+        + (f"  ({', '.join(f'{reason} {count}' for reason, count in sorted(result['fallback_reasons'].items()))})"
+           if result.get("fallback_reasons") else "")
+    )
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(previous_path, results):
+    with open(previous_path) as handle:
+        previous = json.load(handle)
+    baseline = {(r["scenario"], r["concurrency"], r.get("gallery_size")): r for r in previous["results"]}
+    print(f"\nCompared with {previous_path} (commit {previous.get('commit')}):")
+    for result in results:
+        old = baseline.get((result["scenario"], result["concurrency"], result.get("gallery_size")))
+        if old is None:
+            continue
+        throughput = result["throughput_rps"] / old["throughput_rps"] if old["throughput_rps"] else float("nan")
+        p99 = result["p99_ms"] / old["p99_ms"] if old["p99_ms"] else float("nan")
+        print(
+            f"  {result['scenario']:<22} c={result['concurrency']:<4} throughput x{throughput:.2f}  p99 x{p99:.2f}"
+            f"  fallbacks {old.get('fallbacks', 0)} -> {result.get('fallbacks', 0)}"
+        )
+
+
+def parse_list(value, cast=int):
+    return [cast(item) for item in value.split(",") if item.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", type=lambda v: parse_list(v, str), default=list(SCENARIOS),
+                        help=f"comma-separated subset of {', '.join(SCENARIOS)}")
+    parser.add_argument("--concurrency", type=parse_list, default=[1, 10, 50])
+    parser.add_argument("--gallery-sizes", type=parse_list, default=[10, 100, 1000])
+    parser.add_argument("--requests", type=int, default=500, help="requests per scenario run")
+    parser.add_argument("--max-uploads", type=int, default=100, help="cap on requests for gallery_upload")
+    parser.add_argument("--page-size", type=int, default=24)
+    parser.add_argument("--openai-latency", type=float, default=0.2, help="fake OpenAI delay in seconds")
+    parser.add_argument("--mongo-url", help="use a real local mongod instead of the in-memory stand-in")
+    parser.add_argument("--output", help="write machine-readable results to this JSON file")
+    parser.add_argument("--compare", help="previous results JSON to compare against")
+    args = parser.parse_args()
+
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    results = asyncio.run(run(args))
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.utcnow().isoformat() + "Z",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": {
+            "requests": args.requests,
+            "page_size": args.page_size,
+            "openai_latency": args.openai_latency,
+            "mongo": "real" if args.mongo_url else "in-memory",
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as handle:
+            json.dump(report, handle, indent=2)
+        print(f"\nWrote {args.output}")
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
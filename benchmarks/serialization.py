@@ -0,0 +1,97 @@
+"""Micro-benchmark: gallery page serialization and compression, old path vs the response layer.
+
+"legacy" reproduces the previous get_gallery: an isoformat() loop over every document followed
+by FastAPI's jsonable_encoder + json.dumps. "dump_json" is the new orjson path, and each content
+coding is timed cold (compressing) and warm (served from the cached EncodedBody). Pass
+--legacy-base64-kb to include inline base64 image data like the pre-GridFS documents. Run from the
+repository root:
+
+    python benchmarks/serialization.py [--pages 24,100] [--legacy-base64-kb 0,64] [--number 200]
+"""
+import argparse
+import base64
+import copy
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+
+import server  # noqa: E402
+
+
+def gallery_documents(count, base64_kb):
+    started = datetime(2024, 5, 1, 9, 30)
+    documents = []
+    for i in range(count):
+        document = {
+            "id": f"{i:08d}-6c0b-4f39-9a55-3f2d1c0e{i:04d}",
+            "filename": f"treatment-{i}.jpg",
+            "description": "Bridal makeup and party lashes for a summer wedding",
+            "uploaded_at": started - timedelta(minutes=7 * i, microseconds=i),
+            "content_type": "image/jpeg",
+            "size": 180000 + i,
+            "digest": f"{i:064x}",
+            "derivatives": [{"width": width, "content_type": "image/webp"} for width in server.DERIVATIVE_WIDTHS],
+        }
+        if base64_kb:
+            document["image_data"] = base64.b64encode(os.urandom(base64_kb * 768)).decode("ascii")
+        server.add_image_urls(document)
+        documents.append(document)
+    return documents
+
+
+def legacy_body(documents):
+    for image in documents:
+        if isinstance(image.get("uploaded_at"), datetime):
+            image["uploaded_at"] = image["uploaded_at"].isoformat()
+    return JSONResponse(content=jsonable_encoder(documents)).body
+
+
+def cpu_ms(func, number, setup=None):
+    total = 0.0
+    for _ in range(number):
+        argument = setup() if setup else None
+        started = time.process_time()
+        func(argument)
+        total += time.process_time() - started
+    return total / number * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", default="24,100", help="comma-separated page sizes")
+    parser.add_argument("--legacy-base64-kb", default="0,64", help="inline base64 KB per document")
+    parser.add_argument("--number", type=int, default=200, help="repetitions per measurement")
+    args = parser.parse_args()
+
+    print(f"json encoder: {'orjson' if server.orjson is not None else 'json'}; "
+          f"codings: {', '.join(server.RESPONSE_ENCODERS)}; min size {server.COMPRESSION_MIN_BYTES} B\n")
+    print(f"{'page':>5} {'b64 KB':>7}  {'path':<22} {'CPU ms/op':>10} {'bytes sent':>12}")
+    for page in [int(value) for value in args.pages.split(",")]:
+        for base64_kb in [int(value) for value in args.legacy_base64_kb.split(",")]:
+            documents = gallery_documents(page, base64_kb)
+            # The mutation loop rewrites datetimes in place, so each legacy run gets a fresh copy
+            legacy_ms = cpu_ms(legacy_body, args.number, lambda: copy.deepcopy(documents))
+            rows = [("legacy json", legacy_ms, len(legacy_body(copy.deepcopy(documents))))]
+            body = server.dump_json(documents)
+            rows.append(("dump_json", cpu_ms(lambda _: server.dump_json(documents), args.number), len(body)))
+            for coding in server.RESPONSE_ENCODERS:
+                encoded_ms = cpu_ms(lambda payload: payload.encode(coding), args.number,
+                                    lambda: server.EncodedBody(body))
+                cached = server.EncodedBody(body)
+                data, _ = cached.encode(coding)
+                cached_ms = cpu_ms(lambda _: cached.encode(coding), args.number)
+                rows.append((f"{coding} (compress)", encoded_ms, len(data)))
+                rows.append((f"{coding} (cached)", cached_ms, len(data)))
+            for name, milliseconds, size in rows:
+                print(f"{page:>5} {base64_kb:>7}  {name:<22} {milliseconds:>10.3f} {size:>12,}")
+            print()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,8 @@ import './App.css';
 
 const App = () => {
   const [galleryImages, setGalleryImages] = useState([]);
+  const [galleryCursor, setGalleryCursor] = useState(null);
+  const [services, setServices] = useState([]);
   const [showAdminLogin, setShowAdminLogin] = useState(false);
   const [showAdminPanel, setShowAdminPanel] = useState(false);
   const [adminToken, setAdminToken] = useState(localStorage.getItem('adminToken'));
@@ -15,14 +17,32 @@ const App = () => {
 
   useEffect(() => {
     fetchGalleryImages();
+    fetchServices();
   }, []);
 
-  const fetchGalleryImages = async () => {
+  const fetchServices = async () => {
     try {
-      const response = await fetch(`${backendUrl}/api/gallery`);
+      const response = await fetch(`${backendUrl}/api/services`);
+      if (response.ok) {
+        const catalogue = await response.json();
+        setServices(catalogue.categories.map(category => ({
+          category: category.name,
+          items: category.services.map(item => ({ service: item.name, price: item.price_label }))
+        })));
+      }
+    } catch (error) {
+      console.error('Error fetching services:', error);
+    }
+  };
+
+  const fetchGalleryImages = async (after = null) => {
+    try {
+      const query = after ? `?after=${encodeURIComponent(after)}` : '';
+      const response = await fetch(`${backendUrl}/api/gallery${query}`);
       if (response.ok) {
         const images = await response.json();
-        setGalleryImages(images);
+        setGalleryImages(prev => (after ? [...prev, ...images] : images));
+        setGalleryCursor(response.headers.get('X-Next-Cursor'));
       }
     } catch (error) {
       console.error('Error fetching gallery images:', error);
@@ -97,19 +117,43 @@ const App = () => {
     setChatMessages(prev => [...prev, userMessage]);
 
     try {
-      const response = await fetch(`${backendUrl}/api/chat`, {
+      const response = await fetch(`${backendUrl}/api/chat/stream`, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
+          'Accept': 'text/event-stream',
         },
         body: JSON.stringify({ message: chatInput, session_id: sessionId }),
       });
 
-      if (response.ok) {
-        const data = await response.json();
-        const botMessage = { text: data.response, sender: 'bot' };
-        setChatMessages(prev => [...prev, botMessage]);
-        setSessionId(data.session_id);
+      if (response.ok && response.body) {
+        // Show tokens as they arrive instead of waiting for the full answer
+        setChatMessages(prev => [...prev, { text: '', sender: 'bot' }]);
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+          const { done, value } = await reader.read();
+          if (done) break;
+          buffer += decoder.decode(value, { stream: true });
+          const events = buffer.split('\n\n');
+          buffer = events.pop();
+          for (const rawEvent of events) {
+            const lines = rawEvent.split('\n');
+            const eventName = (lines.find(line => line.startsWith('event: ')) || '').slice(7);
+            const dataLine = lines.find(line => line.startsWith('data: '));
+            if (!dataLine) continue;
+            const data = JSON.parse(dataLine.slice(6));
+            if (eventName === 'session' || eventName === 'done') {
+              setSessionId(data.session_id);
+            } else if (data.delta) {
+              setChatMessages(prev => {
+                const last = prev[prev.length - 1];
+                return [...prev.slice(0, -1), { ...last, text: last.text + data.delta }];
+              });
+            }
+          }
+        }
       } else {
         const errorMessage = { text: 'Sorry, I had trouble processing your message. Please try again.', sender: 'bot' };
         setChatMessages(prev => [...prev, errorMessage]);
@@ -123,85 +167,6 @@ const App = () => {
     setChatInput('');
   };
 
-  const services = [
-    {
-      category: "Threading",
-      items: [
-        { service: "Eye Brow", price: "£5" },
-        { service: "Upper Lip", price: "£3" },
-        { service: "Chin", price: "£3" },
-        { service: "Forehead", price: "£3" },
-        { service: "Neck", price: "£3" },
-        { service: "Side Face", price: "£5" },
-        { service: "Full Face", price: "£15" }
-      ]
-    },
-    {
-      category: "Face Waxing",
-      items: [
-        { service: "Eye Brows", price: "£6" },
-        { service: "Upper Lip", price: "£4" },
-        { service: "Chin", price: "£4" },
-        { service: "Forehead", price: "£4" },
-        { service: "Neck", price: "£4" },
-        { service: "Side Face", price: "£6" },
-        { service: "Full Face", price: "£18" }
-      ]
-    },
-    {
-      category: "Body Waxing",
-      items: [
-        { service: "Half Arm", price: "£12" },
-        { service: "Full Arm", price: "£18" },
-        { service: "Under Arm", price: "£8" },
-        { service: "Half Leg", price: "£15" },
-        { service: "Full Leg", price: "£25" },
-        { service: "Full Body (Except Bikini)", price: "£60" }
-      ]
-    },
-    {
-      category: "Pedicure & Manicure",
-      items: [
-        { service: "Pedicure", price: "£25" },
-        { service: "Manicure", price: "£20" }
-      ]
-    },
-    {
-      category: "Eyelash & Tinting",
-      items: [
-        { service: "Full Set Cluster", price: "From £18" },
-        { service: "Party Lashes", price: "£8" },
-        { service: "Eye Brows Tinting", price: "£6" },
-        { service: "Eye Lashes Tinting", price: "£8" }
-      ]
-    },
-    {
-      category: "Facial & Massage",
-      items: [
-        { service: "Mini Facial", price: "£15" },
-        { service: "Full Facial (Cleansing/Whitening/Gold)", price: "£25" },
-        { service: "Herbal Facial", price: "£30" },
-        { service: "Head Massage (With/Without Herbal Oil)", price: "£15" }
-      ]
-    },
-    {
-      category: "Henna & Hair",
-      items: [
-        { service: "One Hand / Foot Henna", price: "From £5" },
-        { service: "Both Hands / Feet Henna", price: "From £10" },
-        { service: "Hair Trimming", price: "£7" },
-        { service: "Any Other Cut", price: "From £12" },
-        { service: "Children (Under 10)", price: "£10" }
-      ]
-    },
-    {
-      category: "Makeup",
-      items: [
-        { service: "Party Makeup", price: "From £30" },
-        { service: "Bridal Makeup", price: "From £150" }
-      ]
-    }
-  ];
 
   return (
     <div className="min-h-screen bg-gray-50">
@@ -307,8 +272,11 @@ const App = () => {
               galleryImages.map((image) => (
                 <div key={image.id} className="bg-white rounded-lg shadow-lg overflow-hidden">
                   <img
-                    src={`data:image/jpeg;base64,${image.image_data}`}
+                    src={image.raw_url ? `${backendUrl}${image.raw_url}` : `data:image/jpeg;base64,${image.image_data}`}
+                    srcSet={image.srcset ? image.srcset.split(', ').map(entry => `${backendUrl}${entry}`).join(', ') : undefined}
+                    sizes="(min-width: 1024px) 33vw, (min-width: 768px) 50vw, 100vw"
                     alt={image.description}
+                    loading="lazy"
                     className="w-full h-64 object-cover"
                   />
                   {image.description && (
@@ -389,6 +357,16 @@ const App = () => {
               </div>
             )}
           </div>
+          {galleryCursor && (
+            <div className="text-center mt-8">
+              <button
+                onClick={() => fetchGalleryImages(galleryCursor)}
+                className="bg-pink-500 text-white px-8 py-3 rounded-lg hover:bg-pink-600 transition-colors"
+              >
+                Load More
+              </button>
+            </div>
+          )}
         </div>
       </section>
 
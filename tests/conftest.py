@@ -0,0 +1,58 @@
+"""Shared fixtures: the API in-process against mongomock-motor and an in-memory GridFS bucket"""
+import io
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "backend"))
+
+import server  # noqa: E402
+from tests.memory_gridfs import InMemoryGridFSBucket  # noqa: E402
+
+
+@pytest.fixture
+def api(monkeypatch):
+    """A TestClient whose lifespan keeps the in-memory Mongo and GridFS stand-ins"""
+    from fastapi.testclient import TestClient
+    from mongomock_motor import AsyncMongoMockClient
+
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    client = AsyncMongoMockClient()
+    # Pre-populate the globals connect_mongo() would set, as benchmarks/load_test.py does
+    monkeypatch.setattr(server, "client", client)
+    monkeypatch.setattr(server, "db", client.beauty_salon_test)
+    monkeypatch.setattr(server, "gallery_fs", InMemoryGridFSBucket())
+    monkeypatch.setattr(server, "close_mongo", lambda: None)
+    monkeypatch.setattr(server, "shared_gallery_versions", None)
+    monkeypatch.setattr(server, "shared_versions_checked_at", 0.0)
+    # Render derivatives on the default thread pool instead of spawning processes
+    monkeypatch.setattr(server, "get_derivative_pool", lambda: None)
+    # Fresh token buckets so chat tests do not spend each other's burst
+    monkeypatch.setattr(server, "chat_rate_limiter", server.TokenBucketLimiter(
+        server.CHAT_RATE_PER_SECOND, server.CHAT_RATE_BURST, server.CHAT_RATE_CLIENTS
+    ))
+    for cache in (server.gallery_page_cache, server.image_bytes_cache, server.answer_cache, server.session_cache):
+        cache.clear()
+    with TestClient(server.app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def auth():
+    token = server.create_access_token({"sub": server.DEFAULT_ADMIN["username"]})
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.fixture
+def make_jpeg():
+    """Factory for small solid-colour JPEGs; different colours give different digests"""
+    from PIL import Image
+
+    def make(width=400, height=300, color=(220, 120, 160)):
+        buffer = io.BytesIO()
+        Image.new("RGB", (width, height), color).save(buffer, "JPEG", quality=85)
+        return buffer.getvalue()
+
+    return make
@@ -0,0 +1,63 @@
+"""In-memory stand-in for the Motor GridFS bucket, shared by the tests and the load test"""
+import itertools
+
+import gridfs
+
+
+class InMemoryGridIn:
+    def __init__(self, bucket, filename, metadata):
+        self._bucket = bucket
+        self._id = next(bucket.ids)
+        self._parts = []
+        self.filename = filename
+        self.metadata = metadata
+
+    async def write(self, data):
+        self._parts.append(bytes(data))
+
+    async def close(self):
+        self._bucket.files[self._id] = b"".join(self._parts)
+
+    async def abort(self):
+        self._parts = []
+
+
+class InMemoryGridOut:
+    def __init__(self, data):
+        self._data = data
+        self._position = 0
+        self.length = len(data)
+
+    def seek(self, position):
+        self._position = position
+
+    async def read(self, size=-1):
+        end = self.length if size is None or size < 0 else self._position + size
+        chunk = self._data[self._position:end]
+        self._position += len(chunk)
+        return chunk
+
+
+class InMemoryGridFSBucket:
+    """The subset of AsyncIOMotorGridFSBucket used by server.py, backed by a dict"""
+
+    def __init__(self):
+        self.files = {}
+        self.ids = itertools.count(1)
+
+    def open_upload_stream(self, filename, metadata=None):
+        return InMemoryGridIn(self, filename, metadata)
+
+    async def upload_from_stream(self, filename, source, metadata=None):
+        file_id = next(self.ids)
+        self.files[file_id] = bytes(source)
+        return file_id
+
+    async def open_download_stream(self, file_id):
+        if file_id not in self.files:
+            raise gridfs.NoFile(file_id)
+        return InMemoryGridOut(self.files[file_id])
+
+    async def delete(self, file_id):
+        if self.files.pop(file_id, None) is None:
+            raise gridfs.NoFile(file_id)
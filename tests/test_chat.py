@@ -0,0 +1,334 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import server
+
+
+class FakeCompletions:
+    """Stands in for AsyncOpenAI().chat.completions, answering after `delay` seconds"""
+
+    def __init__(self, answer="Threading is £5.", delay=0.0):
+        self.answer = answer
+        self.delay = delay
+        self.calls = 0
+
+    async def create(self, stream=False, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if stream:
+            return FakeStream(self.answer.split(" "))
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=self.answer))])
+
+
+class FakeStream:
+    def __init__(self, words):
+        self.chunks = [
+            SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=word + " "))]) for word in words
+        ]
+        self.closed = False
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for chunk in self.chunks:
+            yield chunk
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeOpenAI:
+    def __init__(self, completions):
+        self.chat = SimpleNamespace(completions=completions)
+
+    async def close(self):
+        pass
+
+
+@pytest.fixture
+def completions(api, monkeypatch):
+    completions = FakeCompletions()
+    monkeypatch.setattr(server, "openai_client", FakeOpenAI(completions))
+    return completions
+
+
+def chat(api, message, **fields):
+    response = api.post("/api/chat", json={"message": message, **fields})
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_chat_answers_from_openai(api, completions):
+    body = chat(api, "How much is eyebrow threading?")
+    assert body["response"] == "Threading is £5."
+    assert body["session_id"]
+    assert completions.calls == 1
+
+
+def test_chat_falls_back_when_openai_misses_the_deadline(api, completions, monkeypatch):
+    monkeypatch.setattr(server, "OPENAI_DEADLINE", 0.05)
+    completions.delay = 1
+    before = server.CHAT_FALLBACKS.values.get(("timeout",), 0)
+
+    message = "How much is eyebrow threading?"
+    assert chat(api, message)["response"] == server.get_fallback_response(message)
+    assert server.CHAT_FALLBACKS.values[("timeout",)] == before + 1
+
+
+def test_openai_client_is_pooled_and_created_once(monkeypatch):
+    from openai import AsyncOpenAI
+
+    monkeypatch.setattr(server, "openai_client", None)
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    server.start_openai_client()
+    openai_client = server.openai_client
+    try:
+        assert isinstance(openai_client, AsyncOpenAI)
+        assert openai_client.max_retries == server.OPENAI_MAX_RETRIES
+        server.start_openai_client()
+        assert server.openai_client is openai_client
+    finally:
+        asyncio.run(server.close_openai_client())
+    assert server.openai_client is None
+
+
+def sse_events(body):
+    """(event, data) pairs from a text/event-stream body"""
+    events = []
+    for block in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((fields.get("event"), json.loads(fields["data"])))
+    return events
+
+
+@pytest.mark.parametrize("path, headers", [
+    ("/api/chat/stream", {}),
+    ("/api/chat", {"Accept": "text/event-stream"}),
+])
+def test_chat_streams_openai_deltas_as_server_sent_events(api, completions, path, headers):
+    response = api.post(path, json={"message": "How much is eyebrow threading?", "session_id": "s1"}, headers=headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+
+    events = sse_events(response.text)
+    assert events[0] == ("session", {"session_id": "s1"})
+    assert events[-1] == ("done", {"session_id": "s1"})
+    deltas = [data["delta"] for event, data in events[1:-1]]
+    assert deltas == ["Threading ", "is ", "£5. "]
+    # The streamed answer is remembered for the next turn
+    assert asyncio.run(server.load_session_history("s1"))[-1]["content"] == "".join(deltas)
+
+
+def test_chat_stream_sends_the_fallback_as_one_delta(api, completions, monkeypatch):
+    monkeypatch.setattr(server, "OPENAI_DEADLINE", 0.05)
+    completions.delay = 1
+    message = "How much is eyebrow threading?"
+    events = sse_events(api.post("/api/chat/stream", json={"message": message}).text)
+    assert [data for event, data in events if event is None] == [{"delta": server.get_fallback_response(message)}]
+
+
+def test_answer_cache_key_keeps_non_latin_questions_apart():
+    assert server.answer_cache_key("What are your hours?") == server.answer_cache_key("what are your HOURS")
+    assert server.answer_cache_key("আপনাদের দাম কত?") != server.answer_cache_key("قیمت کیا ہے؟")
+    assert server.answer_cache_key("?!") is None
+
+
+def test_repeated_questions_are_answered_from_the_cache(api, completions):
+    assert chat(api, "How much is eyebrow threading?")["response"] == "Threading is £5."
+    assert chat(api, "how much is EYEBROW threading")["response"] == "Threading is £5."
+    assert completions.calls == 1
+    # Answers that build on earlier turns are not shared
+    session_id = chat(api, "Hi")["session_id"]
+    chat(api, "How much is eyebrow threading?", session_id=session_id)
+    assert completions.calls == 3
+
+
+def test_answer_cache_is_shared_through_mongo(api, completions):
+    chat(api, "Where are you located?")
+    server.answer_cache.clear()
+    chat(api, "Where are you located?")
+    assert completions.calls == 1
+    assert asyncio.run(server.db.chat_answer_cache.count_documents({})) == 1
+
+
+@pytest.mark.parametrize("message, intent", [
+    ("What are your opening hours on Saturday?", "hours"),
+    ("Are you closing early today?", "hours"),
+    ("When are you closed?", "hours"),
+    ("How much is eyebrow threading?", "threading"),
+    ("Do you do party lashes?", "lashes"),
+    ("I need bridal makeup for my wedding", "makeup"),
+    ("How much is hair trimming?", "henna_hair"),
+    ("What are your timings?", "hours"),
+    ("Any openings on Friday?", "hours"),
+    ("Do you do weddings?", "makeup"),
+    ("Are bookings needed?", "booking"),
+    ("How much for a full leg wax?", "waxing"),
+    ("Where are you located?", "location"),
+])
+def test_intent_matcher_routes_to_the_best_intent(message, intent):
+    assert server.service_catalogue.matcher.rank(message)[0][0] == intent
+
+
+def test_intent_matcher_ignores_unrelated_messages_and_non_words():
+    matcher = server.service_catalogue.matcher
+    assert matcher.rank("hello") == []
+    assert matcher.respond("hello") is None
+    # Keywords only match whole words, not inside longer ones or across other scripts
+    assert matcher.rank("Is there space?") == []
+    assert matcher.rank("waxé") == []
+    # Suffixes are stripped from input words, not glued onto keywords
+    assert "closeed" not in matcher.lookup and "triming" not in matcher.lookup
+
+
+def test_intent_matcher_answers_up_to_two_related_intents():
+    matcher = server.service_catalogue.matcher
+    answer = matcher.respond("Can I book a pedicure and a manicure for tomorrow?", 2)
+    assert answer == f"{matcher.answers['nails']} {matcher.answers['booking']}"
+    assert matcher.respond("Can I book a pedicure and a manicure for tomorrow?", 1) == matcher.answers["nails"]
+
+
+@pytest.mark.parametrize("word, stem", [
+    ("closed", "clos"), ("closing", "clos"), ("close", "clos"),
+    ("trimming", "trim"), ("trim", "trim"), ("lashes", "lash"),
+    ("parties", "party"), ("address", "address"), ("hours", "hour"),
+])
+def test_stem_word(word, stem):
+    assert server.stem_word(word) == stem
+
+
+def test_inflections_cover_plurals_tenses_and_doubled_consonants():
+    assert {"close", "closes", "closed", "closing"} <= server.inflections("clos")
+    assert {"trim", "trims", "trimmed", "trimming"} <= server.inflections("trim")
+    assert server.inflections("party") == {"party", "parties", "partied"}
+
+
+def test_intent_matcher_shares_rankings_between_paraphrases():
+    matcher = server.IntentMatcher([("hours", {"hour": 3, "open": 3}, "9 to 5"), ("lashes", {"party lash": 3}, "£8")])
+    assert matcher.rank("When do you open?") == [("hours", 3)]
+    assert matcher.rank("Opening times?") == [("hours", 3)]
+    assert len(matcher.rankings) == 1
+    assert matcher.respond("Party lashes, and what hours?", 2) == "9 to 5 £8"
+
+
+def turn(role, content):
+    return {"role": role, "content": content}
+
+
+def test_trim_history_keeps_everything_within_budget():
+    turns = [turn("user", "Do you do threading?"), turn("assistant", "Yes, eyebrows are £5.")]
+    assert server.trim_history(turns, 1000) == turns
+    assert server.trim_history([], 1000) == []
+
+
+def test_trim_history_drops_oldest_turns_and_summarizes_their_questions():
+    turns = [
+        turn("user", "How much is bridal makeup?"),
+        turn("assistant", "Bridal makeup starts from £150. " * 10),
+        turn("user", "And party lashes?"),
+        turn("assistant", "Party lashes are £8."),
+    ]
+    # Room for the last exchange and a short summary, not for the long reply
+    budget = sum(server.estimate_tokens(t["content"]) for t in turns[2:]) + 40
+    trimmed = server.trim_history(turns, budget)
+
+    assert trimmed[1:] == turns[2:]
+    summary = trimmed[0]
+    assert summary["role"] == "system"
+    assert "How much is bridal makeup?" in summary["content"]
+    assert sum(server.estimate_tokens(t["content"]) for t in trimmed) <= budget
+
+
+def test_trim_history_never_starts_on_an_assistant_reply():
+    turns = [
+        turn("user", "Where are you?" * 20),
+        turn("assistant", "Woodgrange Road."),
+        turn("user", "Open Sunday?"),
+        turn("assistant", "No, Monday to Saturday."),
+    ]
+    # Room for the last three turns, but the first of them is an orphaned reply
+    budget = sum(server.estimate_tokens(t["content"]) for t in turns[1:])
+    trimmed = server.trim_history(turns, budget)
+    assert [t["role"] for t in trimmed if t["role"] != "system"] == ["user", "assistant"]
+
+
+def test_chat_remembers_the_conversation(api, completions):
+    session_id = chat(api, "Do you do threading?")["session_id"]
+    chat(api, "How much is it?", session_id=session_id)
+
+    history = asyncio.run(server.db.chat_sessions.find_one({"_id": session_id}))["turns"]
+    assert [t["content"] for t in history if t["role"] == "user"] == ["Do you do threading?", "How much is it?"]
+    # A worker without the session cached reads the same history from Mongo
+    server.session_cache.clear()
+    assert asyncio.run(server.load_session_history(session_id)) == history
+
+
+
+def test_callers_joining_an_identical_call_spend_no_tokens(api, completions, monkeypatch):
+    monkeypatch.setattr(server, "chat_rate_limiter", server.TokenBucketLimiter(rate=0.001, burst=1, max_clients=10))
+    completions.delay = 0.05
+    client_keys = ["ip:198.51.100.7"]
+
+    async def ask(message):
+        return await server.get_ai_response(message, None, client_keys)
+
+    async def stream(message):
+        return "".join([delta async for delta in server.stream_ai_response(message, None, client_keys)])
+
+    async def main():
+        return await asyncio.gather(ask("Do you do threading?"), ask("Do you do threading?"), ask("do you do THREADING"))
+
+    assert asyncio.run(main()) == ["Threading is £5."] * 3
+    assert completions.calls == 1
+    assert server.chat_rate_limiter.limited == 0
+    # The next question that goes upstream finds the bucket empty
+    assert asyncio.run(stream("Where are you located?")) == server.get_fallback_response("Where are you located?")
+    assert server.chat_rate_limiter.limited == 1
+
+
+def test_streamed_followers_spend_no_tokens(api, completions, monkeypatch):
+    monkeypatch.setattr(server, "chat_rate_limiter", server.TokenBucketLimiter(rate=0.001, burst=1, max_clients=10))
+    completions.delay = 0.05
+
+    async def stream():
+        return "".join([delta async for delta in server.stream_ai_response("Open Sunday?", None, ["session:a"])])
+
+    async def main():
+        return await asyncio.gather(stream(), stream())
+
+    assert asyncio.run(main()) == ["Threading is £5. "] * 2
+    assert (completions.calls, server.chat_rate_limiter.limited) == (1, 0)
+
+
+def resolved_request(peer, forwarded, trusted="10.0.0.1"):
+    """The Request the app sees once uvicorn's proxy header handling has run"""
+    from starlette.requests import Request
+    from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware
+
+    seen = {}
+
+    async def app(scope, receive, send):
+        seen["scope"] = scope
+
+    headers = [(b"x-forwarded-for", forwarded.encode())] if forwarded else []
+    scope = {"type": "http", "headers": headers, "client": (peer, 5000)}
+    asyncio.run(ProxyHeadersMiddleware(app, trusted)(scope, None, None))
+    return Request(seen["scope"])
+
+
+@pytest.mark.parametrize("peer, forwarded, trusted, keys", [
+    ("10.0.0.1", "198.51.100.7", "10.0.0.1", ["ip:198.51.100.7", "session:s1"]),
+    ("10.0.0.1", "198.51.100.7, 10.0.0.1", "10.0.0.1", ["ip:198.51.100.7", "session:s1"]),
+    ("10.0.0.2", "198.51.100.7", "*", ["ip:198.51.100.7", "session:s1"]),
+    # Behind an ingress with no forwarded header every visitor shares the peer address
+    ("10.0.0.1", None, "10.0.0.1", ["session:s1"]),
+    # An untrusted peer cannot pick its own bucket
+    ("203.0.113.5", "198.51.100.7", "10.0.0.1", ["session:s1"]),
+])
+def test_chat_keys_by_address_only_from_trusted_forwarded_headers(peer, forwarded, trusted, keys):
+    request = resolved_request(peer, forwarded, trusted)
+    assert server.chat_client_keys(server.ChatMessage(message="Hi", session_id="s1"), request) == keys
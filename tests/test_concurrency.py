@@ -0,0 +1,166 @@
+import asyncio
+
+import pytest
+
+import server
+
+
+def test_singleflight_shares_one_call_between_concurrent_callers():
+    calls = []
+
+    async def load():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "page"
+
+    async def main():
+        flight = server.SingleFlight()
+        leader = asyncio.ensure_future(flight.do("key", load))
+        await asyncio.sleep(0)
+        assert flight.in_flight("key") and not flight.in_flight("key", stream=True)
+        results = await asyncio.gather(leader, *(flight.do("key", load) for _ in range(4)))
+        assert results == ["page"] * 5
+        assert not flight.in_flight("key")
+        assert (flight.leaders, flight.followers) == (1, 4)
+        # Finished calls are forgotten, so the next miss runs again
+        assert await flight.do("key", load) == "page"
+
+    asyncio.run(main())
+    assert len(calls) == 2
+
+
+def test_singleflight_shares_errors_and_then_retries():
+    attempts = []
+
+    async def load():
+        attempts.append(1)
+        await asyncio.sleep(0.01)
+        raise RuntimeError("mongo down")
+
+    async def main():
+        flight = server.SingleFlight()
+        results = await asyncio.gather(*(flight.do("key", load) for _ in range(3)), return_exceptions=True)
+        assert all(isinstance(result, RuntimeError) for result in results)
+        with pytest.raises(RuntimeError):
+            await flight.do("key", load)
+
+    asyncio.run(main())
+    assert len(attempts) == 2
+
+
+def test_singleflight_cancellation():
+    started = []
+
+    async def load():
+        started.append(1)
+        await asyncio.sleep(0.05)
+        return "answer"
+
+    async def main():
+        flight = server.SingleFlight()
+        # One caller giving up does not cancel the work the others wait on
+        first = asyncio.create_task(flight.do("key", load))
+        second = asyncio.create_task(flight.do("key", load))
+        await asyncio.sleep(0)
+        first.cancel()
+        assert await second == "answer"
+        with pytest.raises(asyncio.CancelledError):
+            await first
+
+        # When every caller gives up the shared task is cancelled too
+        only = asyncio.create_task(flight.do("other", load))
+        await asyncio.sleep(0.01)
+        shared = flight._calls["other"].task
+        only.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await only
+        await asyncio.sleep(0)
+        assert shared.cancelled()
+        assert "other" not in flight._calls
+
+    asyncio.run(main())
+    assert len(started) == 2
+
+
+def test_singleflight_stream_replays_chunks_to_late_subscribers():
+    async def source():
+        for chunk in ("We ", "are ", "open"):
+            yield chunk
+            await asyncio.sleep(0.01)
+
+    async def collect(flight, delay):
+        await asyncio.sleep(delay)
+        return "".join([chunk async for chunk in flight.stream("key", source)])
+
+    async def main():
+        flight = server.SingleFlight()
+        results = await asyncio.gather(collect(flight, 0), collect(flight, 0.015))
+        assert results == ["We are open", "We are open"]
+        assert (flight.leaders, flight.followers) == (1, 1)
+
+    asyncio.run(main())
+
+
+def test_admission_controller_sheds_when_the_queue_is_full():
+    async def main():
+        admission = server.AdmissionController(max_concurrency=1, queue_size=1, queue_timeout=1)
+        release = asyncio.Event()
+
+        async def call():
+            async with admission.slot():
+                await release.wait()
+
+        running = asyncio.create_task(call())
+        queued = asyncio.create_task(call())
+        await asyncio.sleep(0.01)
+        assert (admission.in_flight, admission.waiting) == (1, 1)
+        with pytest.raises(server.LLMOverloaded) as raised:
+            async with admission.slot():
+                pass
+        assert raised.value.reason == "queue_full"
+
+        release.set()
+        await asyncio.gather(running, queued)
+        assert admission.admitted == 2
+        assert admission.shed == {"queue_full": 1, "queue_timeout": 0}
+        assert (admission.in_flight, admission.waiting) == (0, 0)
+
+    asyncio.run(main())
+
+
+def test_admission_controller_sheds_after_the_queue_timeout():
+    async def main():
+        admission = server.AdmissionController(max_concurrency=1, queue_size=4, queue_timeout=0.02)
+        async with admission.slot():
+            with pytest.raises(server.LLMOverloaded) as raised:
+                async with admission.slot():
+                    pass
+        assert raised.value.reason == "queue_timeout"
+        assert admission.shed == {"queue_full": 0, "queue_timeout": 1}
+        assert admission.waiting == 0
+
+    asyncio.run(main())
+
+
+def test_token_bucket_allows_a_burst_then_refills(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(server.time, "monotonic", lambda: now[0])
+    limiter = server.TokenBucketLimiter(rate=0.5, burst=2, max_clients=10)
+
+    assert [limiter.allow("ip:1") for _ in range(3)] == [True, True, False]
+    assert limiter.allow("ip:2")
+    now[0] += 2
+    assert limiter.allow("ip:1")
+    assert not limiter.allow("ip:1")
+    assert limiter.limited == 2
+
+
+def test_token_bucket_requires_every_key_and_can_be_disabled():
+    limiter = server.TokenBucketLimiter(rate=0.001, burst=1, max_clients=10)
+    assert limiter.allow_all(["ip:1", "session:a"])
+    # A fresh session id does not buy the same address another token
+    assert not limiter.allow_all(["ip:1", "session:b"])
+    assert limiter.allow_all(["ip:2", "session:b"])
+
+    disabled = server.TokenBucketLimiter(rate=0, burst=1, max_clients=10)
+    assert all(disabled.allow("ip:1") for _ in range(10))
@@ -0,0 +1,291 @@
+import asyncio
+import io
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+from starlette.datastructures import Headers, UploadFile
+
+import server
+
+
+def upload(api, auth, data, filename="look.jpg", content_type="image/jpeg"):
+    return api.post(
+        "/api/gallery",
+        files={"file": (filename, data, content_type)},
+        data={"description": "test"},
+        headers=auth,
+    )
+
+
+def seed_gallery(documents):
+    asyncio.run(server.db.gallery.insert_many(documents))
+
+
+def gallery_document(image_id, uploaded_at):
+    return {
+        "id": image_id,
+        "filename": f"{image_id}.jpg",
+        "digest": image_id.rjust(64, "0"),
+        "file_id": image_id,
+        "content_type": "image/jpeg",
+        "size": 1000,
+        "description": "Bridal makeup and party lashes for a summer wedding",
+        "uploaded_at": uploaded_at,
+    }
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, None),
+    ("bytes=0-9", (0, 9)),
+    ("bytes=90-", (90, 99)),
+    ("bytes=-10", (90, 99)),
+    ("bytes=-500", (0, 99)),
+    ("bytes=50-1000", (50, 99)),
+    ("items=0-9", None),
+    ("bytes=0-1,5-6", None),
+    ("bytes=abc", None),
+    ("bytes=-0", None),
+])
+def test_parse_range_header(header, expected):
+    assert server.parse_range_header(header, 100) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=100-", "bytes=20-10"])
+def test_parse_range_header_unsatisfiable(header):
+    with pytest.raises(HTTPException) as raised:
+        server.parse_range_header(header, 100)
+    assert raised.value.status_code == 416
+    assert raised.value.headers["Content-Range"] == "bytes */100"
+
+
+@pytest.mark.parametrize("max_item_bytes", [2 * 1024 * 1024, 0], ids=["cached", "streamed"])
+def test_raw_image_range_requests(api, auth, make_jpeg, monkeypatch, max_item_bytes):
+    monkeypatch.setattr(server, "IMAGE_CACHE_MAX_ITEM_BYTES", max_item_bytes)
+    data = make_jpeg()
+    raw_url = upload(api, auth, data).json()["raw_url"]
+
+    response = api.get(raw_url, headers={"Range": "bytes=0-9"})
+    assert response.status_code == 206
+    assert response.content == data[:10]
+    assert response.headers["Content-Range"] == f"bytes 0-9/{len(data)}"
+    assert response.headers["X-Content-Type-Options"] == "nosniff"
+
+    response = api.get(raw_url, headers={"Range": f"bytes={len(data)}-"})
+    assert response.status_code == 416
+    assert response.headers["Content-Range"] == f"bytes */{len(data)}"
+
+    response = api.get(raw_url)
+    assert response.status_code == 200
+    assert response.content == data
+    assert api.get(raw_url, headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+
+
+def test_delete_unknown_image_is_404(api, auth):
+    assert api.delete("/api/gallery/missing", headers=auth).status_code == 404
+
+
+@pytest.mark.parametrize("filename, data, content_type, detail", [
+    ("notes.txt", b"hello", "text/plain", "Only image uploads are accepted"),
+    ("page.png", b"<script>alert(1)</script>", "image/png", "File is not a readable image"),
+])
+def test_upload_rejects_non_images(api, auth, filename, data, content_type, detail):
+    response = upload(api, auth, data, filename=filename, content_type=content_type)
+    assert response.status_code == 415
+    assert response.json()["detail"] == detail
+    assert server.gallery_fs.files == {}
+
+
+def test_keyset_cursor_pages_through_ties_without_gaps(api):
+    now = datetime(2024, 5, 1, 9, 30)
+    # Several uploads share a timestamp so the id tie-break decides their order
+    documents = [gallery_document(f"img-{i:02d}", now - timedelta(seconds=i // 3)) for i in range(10)]
+    expected = [
+        document["id"]
+        for document in sorted(documents, key=lambda document: (document["uploaded_at"], document["id"]), reverse=True)
+    ]
+    seed_gallery(documents)
+
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 3, **({"after": cursor} if cursor else {})}
+        response = api.get("/api/gallery", params=params)
+        assert response.status_code == 200
+        seen += [image["id"] for image in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+    assert seen == expected
+
+
+def test_keyset_cursor_round_trip_and_invalid_cursor(api):
+    image = {"id": "abc", "uploaded_at": datetime(2024, 5, 1, 9, 30, 0, 123456)}
+    assert server.decode_gallery_cursor(server.encode_gallery_cursor(image)) == (image["uploaded_at"], "abc")
+    assert api.get("/api/gallery", params={"after": "not-a-cursor"}).status_code == 400
+
+
+def test_gallery_listing_returns_metadata_only(api):
+    document = gallery_document("img-01", datetime(2024, 5, 1))
+    document["image_data"] = "aGVsbG8="
+    document["derivatives"] = [{"width": 320, "file_id": "thumb", "size": 100}]
+    seed_gallery([document])
+
+    [image] = api.get("/api/gallery").json()
+    assert "image_data" not in image and "file_id" not in image and "_id" not in image
+    assert image["derivatives"] == [{"width": 320, "size": 100}]
+    assert image["raw_url"].startswith("/api/gallery/img-01/raw")
+    assert image["thumbnail_url"].startswith("/api/gallery/img-01/w/320")
+
+
+def test_derivative_pool_spawns_ready_workers(monkeypatch, make_jpeg, tmp_path):
+    monkeypatch.setattr(server, "derivative_pool", None)
+    monkeypatch.setattr(server, "DERIVATIVE_WORKERS", 1)
+    server.start_derivative_pool()
+    try:
+        pool = server.derivative_pool
+        assert pool._mp_context.get_start_method() == "spawn"
+        assert len(pool._processes) == 1
+        source = tmp_path / "look.jpg"
+        source.write_bytes(make_jpeg())
+        rendered = pool.submit(server.render_derivatives, str(source), [320], "WEBP", 80).result(timeout=60)
+        assert [item["width"] for item in rendered] == [320]
+    finally:
+        server.shutdown_derivative_pool()
+
+
+def test_gallery_listing_revalidates_and_follows_uploads(api, auth, make_jpeg):
+    seed_gallery([gallery_document("img-01", datetime(2024, 5, 1))])
+    first = api.get("/api/gallery")
+    etag = first.headers["ETag"]
+    assert api.get("/api/gallery", headers={"If-None-Match": etag}).status_code == 304
+
+    uploaded = upload(api, auth, make_jpeg()).json()
+    response = api.get("/api/gallery", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert [image["id"] for image in response.json()] == [uploaded["id"], "img-01"]
+
+
+def test_gallery_cache_follows_changes_from_other_processes(api, monkeypatch):
+    monkeypatch.setattr(server, "CACHE_SYNC_INTERVAL", 0)
+    seed_gallery([gallery_document("img-01", datetime(2024, 5, 1))])
+    assert [image["id"] for image in api.get("/api/gallery").json()] == ["img-01"]
+
+    # Another worker inserts an image and bumps the shared version
+    seed_gallery([gallery_document("img-02", datetime(2024, 5, 2))])
+    assert [image["id"] for image in api.get("/api/gallery").json()] == ["img-01"]
+    asyncio.run(server.db.cache_versions.update_one({"_id": "gallery"}, {"$inc": {"version": 1}}, upsert=True))
+    assert [image["id"] for image in api.get("/api/gallery").json()] == ["img-02", "img-01"]
+
+
+def test_image_bytes_cache_drops_images_deleted_by_other_processes(api, auth, make_jpeg, monkeypatch):
+    monkeypatch.setattr(server, "CACHE_SYNC_INTERVAL", 0)
+    uploaded = upload(api, auth, make_jpeg()).json()
+    assert api.get(uploaded["raw_url"]).status_code == 200
+    assert len(server.image_bytes_cache) == 1
+
+    # Another worker deletes the image; this one must stop serving its cached bytes
+    asyncio.run(server.db.cache_versions.update_one({"_id": "gallery"}, {"$inc": {"deletes": 1}}, upsert=True))
+    asyncio.run(server.db.gallery.delete_one({"id": uploaded["id"]}))
+    assert api.get(uploaded["raw_url"]).status_code == 404
+
+
+def upload_batch(api, auth, files, **data):
+    return api.post(
+        "/api/gallery/batch",
+        files=[("files", file) for file in files],
+        data=data,
+        headers=auth,
+    )
+
+
+def test_batch_upload_reports_each_file(api, auth, make_jpeg, monkeypatch, tmp_path):
+    monkeypatch.setattr(server.tempfile, "tempdir", str(tmp_path))
+    files = [
+        ("a.jpg", make_jpeg(color=(10, 20, 30)), "image/jpeg"),
+        ("notes.txt", b"hello", "text/plain"),
+        ("b.jpg", make_jpeg(color=(40, 50, 60)), "image/jpeg"),
+    ]
+    response = upload_batch(api, auth, files, descriptions=["first", "", "third"])
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["uploaded"], body["failed"]) == (2, 1)
+    assert [entry["status"] for entry in body["files"]] == ["ok", "error", "ok"]
+    assert body["files"][1]["error"] == "Only image uploads are accepted"
+
+    listing = api.get("/api/gallery").json()
+    assert sorted(image["description"] for image in listing) == ["first", "third"]
+    assert all(image["derivatives"] for image in listing)
+    # Derivatives were rendered from spooled copies that are gone again
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_batch_upload_rejects_oversized_files_before_decoding_them(api, auth, make_jpeg, monkeypatch):
+    data = make_jpeg()
+    monkeypatch.setattr(server, "MAX_UPLOAD_BYTES", len(data) - 1)
+    monkeypatch.setattr(server, "detect_image_type", lambda fileobj: pytest.fail("decoded an oversized file"))
+    body = upload_batch(api, auth, [("big.jpg", data, "image/jpeg")]).json()
+    assert body["files"][0] == {"filename": "big.jpg", "status": "error", "error": f"File exceeds {len(data) - 1} bytes"}
+    assert server.gallery_fs.files == {}
+
+
+def test_batch_upload_limits_the_number_of_files(api, auth, make_jpeg, monkeypatch):
+    monkeypatch.setattr(server, "BATCH_MAX_FILES", 2)
+    files = [(f"{i}.jpg", make_jpeg(), "image/jpeg") for i in range(3)]
+    response = upload_batch(api, auth, files)
+    assert response.status_code == 413
+    assert server.gallery_fs.files == {}
+
+
+def test_identical_uploads_share_one_blob_until_the_last_delete(api, auth, make_jpeg):
+    data = make_jpeg()
+    first = upload(api, auth, data).json()
+    second = upload(api, auth, data, filename="again.jpg").json()
+    assert first["digest"] == second["digest"]
+
+    blob = asyncio.run(server.db.image_blobs.find_one({"_id": first["digest"]}))
+    assert blob["refs"] == 2
+    # One original plus one 320w derivative, stored once for both entries
+    assert len(server.gallery_fs.files) == 2
+
+    assert api.delete(f"/api/gallery/{first['id']}", headers=auth).status_code == 200
+    blob = asyncio.run(server.db.image_blobs.find_one({"_id": first["digest"]}))
+    assert blob["refs"] == 1
+    assert len(server.gallery_fs.files) == 2
+    assert api.get(second["raw_url"]).content == data
+
+    assert api.delete(f"/api/gallery/{second['id']}", headers=auth).status_code == 200
+    assert asyncio.run(server.db.image_blobs.find_one({"_id": first["digest"]})) is None
+    assert server.gallery_fs.files == {}
+
+
+def test_concurrent_identical_uploads_all_get_derivatives(api, make_jpeg):
+    data = make_jpeg()
+
+    async def upload_all():
+        files = [
+            UploadFile(io.BytesIO(data), filename=f"{i}.jpg", headers=Headers({"content-type": "image/jpeg"}))
+            for i in range(3)
+        ]
+        return await asyncio.gather(*(server.prepare_gallery_item(file, "") for file in files))
+
+    items = asyncio.run(upload_all())
+    assert len({item["file_id"] for item in items}) == 1
+    assert all([d["width"] for d in item["derivatives"]] == [320] for item in items)
+    # The losing uploads dropped their own copies
+    assert len(server.gallery_fs.files) == 2
+
+
+def test_backfill_renders_missing_derivatives_once(api, auth, make_jpeg, monkeypatch):
+    monkeypatch.setattr(server, "connect_mongo", lambda: server.db)
+    large = upload(api, auth, make_jpeg()).json()
+    small = upload(api, auth, make_jpeg(width=200, height=150)).json()
+    asyncio.run(server.db.gallery.update_one({"id": large["id"]}, {"$unset": {"derivatives": ""}}))
+    asyncio.run(server.db.image_blobs.update_one({"_id": large["digest"]}, {"$unset": {"derivatives": ""}}))
+
+    assert asyncio.run(server.backfill_derivatives()) == 1
+    image = asyncio.run(server.db.gallery.find_one({"id": large["id"]}))
+    assert [d["width"] for d in image["derivatives"]] == [320]
+    # Narrower than every width: [] is finished, not pending, and is not rendered again
+    assert asyncio.run(server.db.gallery.find_one({"id": small["id"]}))["derivatives"] == []
+    assert asyncio.run(server.backfill_derivatives()) == 0
+
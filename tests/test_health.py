@@ -0,0 +1,57 @@
+import asyncio
+
+import server
+
+
+def test_health_reports_the_mongo_ping(api):
+    body = api.get("/api/health").json()
+    assert body["status"] == "healthy"
+    assert body["mongo"]["ok"] is True
+    assert body["mongo"]["ping_ms"] >= 0
+
+
+def test_health_is_degraded_when_mongo_does_not_answer(api, monkeypatch):
+    async def hang(*args, **kwargs):
+        await asyncio.sleep(1)
+
+    monkeypatch.setattr(server, "HEALTH_PING_TIMEOUT", 0.05)
+    monkeypatch.setattr(server.db, "command", hang)
+    body = api.get("/api/health").json()
+    assert body["status"] == "degraded"
+    assert body["mongo"]["ok"] is False
+
+
+def test_startup_creates_the_indexes_hot_queries_use(api):
+    gallery = asyncio.run(server.db.gallery.index_information())
+    keys = [index["key"] for index in gallery.values()]
+    assert [("uploaded_at", -1), ("id", -1)] in keys
+    assert [("digest", 1)] in keys
+    assert gallery["id_1"]["unique"]
+
+    sessions = asyncio.run(server.db.chat_sessions.index_information())
+    assert sessions["expires_at_1"]["expireAfterSeconds"] == 0
+
+
+def test_ensure_indexes_is_idempotent(api):
+    before = asyncio.run(server.db.gallery.index_information())
+    asyncio.run(server.ensure_indexes())
+    assert asyncio.run(server.db.gallery.index_information()) == before
+
+
+def test_connect_mongo_configures_one_shared_pool(monkeypatch):
+    for name in ("client", "db", "gallery_fs"):
+        monkeypatch.setattr(server, name, None)
+
+    async def main():
+        # Motor binds the client to the running loop; nothing connects until the first command
+        db = server.connect_mongo()
+        try:
+            assert server.connect_mongo() is db
+            pool = server.client.delegate.options.pool_options
+            assert pool.max_pool_size == server.MONGO_MAX_POOL_SIZE
+            assert pool.max_idle_time_seconds == server.MONGO_MAX_IDLE_TIME_MS / 1000
+        finally:
+            server.close_mongo()
+
+    asyncio.run(main())
+    assert server.client is None
@@ -0,0 +1,112 @@
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+import metrics
+import server
+
+
+def scrape(api):
+    response = api.get("/api/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    return response.text.splitlines()
+
+
+def observed(histogram, *labels):
+    series = histogram.values.get(labels)
+    return (series[1], series[2]) if series else (0.0, 0)
+
+
+def test_metrics_label_requests_by_route_template(api):
+    labels = ("GET", "/api/gallery/{image_id}/raw", "404")
+    _, before = observed(metrics.HTTP_REQUEST_SECONDS, *labels)
+    for image_id in ("a", "b"):
+        api.get(f"/api/gallery/{image_id}/raw")
+    lines = scrape(api)
+    count = 'http_request_duration_seconds_count{method="GET",route="/api/gallery/{image_id}/raw",status="404"}'
+    assert f"{count} {before + 2}" in lines
+    assert "# TYPE http_request_duration_seconds histogram" in lines
+    assert any(line.startswith('process_startup_seconds{phase="indexes"}') for line in lines)
+
+
+def test_mongo_command_listener_times_commands_by_collection():
+    listener = metrics.MongoCommandMetrics()
+    total, count = observed(metrics.MONGO_COMMAND_SECONDS, "find", "gallery", "ok")
+    listener.started(SimpleNamespace(command={"find": "gallery"}, command_name="find", connection_id=("db", 1), request_id=7))
+    listener.succeeded(SimpleNamespace(command_name="find", connection_id=("db", 1), request_id=7, duration_micros=1500))
+    after_total, after_count = observed(metrics.MONGO_COMMAND_SECONDS, "find", "gallery", "ok")
+    assert after_count == count + 1
+    assert abs(after_total - total - 0.0015) < 1e-9
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = metrics.Histogram("test_seconds", "Test", ("route",), buckets=(0.1, 1))
+    for value in (0.05, 0.5, 5):
+        histogram.observe(value, route='/a"b')
+    assert histogram.render()[2:] == [
+        'test_seconds_bucket{route="/a\\"b",le="0.1"} 1',
+        'test_seconds_bucket{route="/a\\"b",le="1.0"} 2',
+        'test_seconds_bucket{route="/a\\"b",le="+Inf"} 3',
+        'test_seconds_sum{route="/a\\"b"} 5.55',
+        'test_seconds_count{route="/a\\"b"} 3',
+    ]
+
+
+def test_merged_metrics_label_each_worker(tmp_path):
+    (tmp_path / "101.prom").write_text("# HELP jobs_total Jobs\n# TYPE jobs_total counter\njobs_total{kind=\"a\"} 1\n")
+    (tmp_path / "102.prom").write_text("# HELP jobs_total Jobs\n# TYPE jobs_total counter\njobs_total{kind=\"a\"} 2\nuptime 7\n")
+    assert metrics.merged_metric_lines(str(tmp_path)) == [
+        "# HELP jobs_total Jobs",
+        "# TYPE jobs_total counter",
+        'jobs_total{kind="a",worker="101"} 1',
+        'jobs_total{kind="a",worker="102"} 2',
+        'uptime{worker="102"} 7',
+    ]
+    metrics.remove_worker_metrics(str(tmp_path), 101)
+    assert [path.name for path in tmp_path.iterdir()] == ["102.prom"]
+
+
+def test_scrape_merges_every_worker_when_multiprocess(api, monkeypatch, tmp_path):
+    monkeypatch.setattr(server, "METRICS_MULTIPROC_DIR", str(tmp_path))
+    metrics.write_worker_metrics(str(tmp_path), ["# TYPE chat_responses_total counter", 'chat_responses_total{source="cache"} 4'])
+    # Pose as another worker that exported earlier
+    os.replace(tmp_path / f"{os.getpid()}.prom", tmp_path / "1.prom")
+
+    lines = scrape(api)
+    assert 'chat_responses_total{source="cache",worker="1"} 4' in lines
+    # This worker re-exported its own series for the scrape
+    assert any(line.startswith("http_request_duration_seconds") and 'worker="' in line for line in lines)
+
+
+def test_stack_sampler_records_the_target_thread():
+    stop = threading.Event()
+
+    def busy_loop():
+        while not stop.is_set():
+            sum(range(100))
+
+    thread = threading.Thread(target=busy_loop)
+    thread.start()
+    sampler = metrics.StackSampler()
+    sampler.start(thread.ident, 0.001)
+    time.sleep(0.1)
+    sampler.stop()
+    stop.set()
+    thread.join()
+
+    assert sampler.total > 0
+    [hottest] = sampler.top(1)
+    assert "busy_loop" in hottest["stack"]
+    sampler.reset()
+    assert sampler.total == 0
+
+
+def test_profile_endpoint_requires_the_profiler_and_auth(api, auth, monkeypatch):
+    assert api.get("/api/admin/profile", headers=auth).status_code == 404
+    monkeypatch.setattr(server, "PROFILER_SAMPLE_INTERVAL", 0.01)
+    assert api.get("/api/admin/profile").status_code == 403
+    report = api.get("/api/admin/profile", params={"top": 5, "reset": True}, headers=auth).json()
+    assert report["interval_s"] == 0.01
+    assert set(report) == {"interval_s", "samples", "stacks"}
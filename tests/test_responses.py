@@ -0,0 +1,67 @@
+import asyncio
+import gzip
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+import server
+
+
+@pytest.mark.parametrize("accept_encoding, expected", [
+    (None, None),
+    ("", None),
+    ("identity", None),
+    ("gzip", "gzip"),
+    ("gzip;q=0", None),
+    ("deflate, gzip;q=0.5", "gzip"),
+    ("*", next(iter(server.RESPONSE_ENCODERS))),
+    ("*, gzip;q=0", next((coding for coding in server.RESPONSE_ENCODERS if coding != "gzip"), None)),
+])
+def test_negotiate_encoding(accept_encoding, expected):
+    assert server.negotiate_encoding(accept_encoding) == expected
+
+
+def test_encoded_body_compresses_once_and_skips_small_or_incompressible_bodies():
+    body = b'{"description":"Bridal makeup and party lashes"}' * 100
+    payload = server.EncodedBody(body)
+    data, encoding = payload.encode("gzip")
+    assert encoding == "gzip"
+    assert gzip.decompress(data) == body
+    assert payload.encode("gzip")[0] is data
+
+    assert server.EncodedBody(b'{"ok":true}').encode("gzip") == (b'{"ok":true}', None)
+    random_body = os.urandom(4096)
+    assert server.EncodedBody(random_body).encode("gzip") == (random_body, None)
+    assert payload.encode(None) == (body, None)
+
+
+def test_gallery_listing_negotiates_encoding_and_revalidates(api):
+    now = datetime(2024, 5, 1, 9, 30)
+    asyncio.run(server.db.gallery.insert_many([
+        {
+            "id": f"img-{i:02d}",
+            "filename": f"img-{i}.jpg",
+            "content_type": "image/jpeg",
+            "size": 1000,
+            "description": "Bridal makeup and party lashes for a summer wedding",
+            "uploaded_at": now - timedelta(minutes=i),
+        }
+        for i in range(20)
+    ]))
+
+    plain = api.get("/api/gallery", headers={"Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in plain.headers
+    assert plain.headers["Vary"] == "Accept-Encoding"
+    etag = plain.headers["ETag"]
+
+    compressed = api.get("/api/gallery", headers={"Accept-Encoding": "gzip"})
+    assert compressed.headers["Content-Encoding"] == "gzip"
+    assert compressed.headers["ETag"] == f'{etag[:-1]}-gzip"'
+    assert compressed.json() == plain.json()
+
+    for accept_encoding, if_none_match in (("identity", etag), ("gzip", compressed.headers["ETag"]), ("gzip", etag)):
+        response = api.get("/api/gallery", headers={"Accept-Encoding": accept_encoding, "If-None-Match": if_none_match})
+        assert response.status_code == 304
+        assert response.content == b""
+    assert api.get("/api/gallery", headers={"If-None-Match": '"stale"'}).status_code == 200
@@ -0,0 +1,33 @@
+import server
+
+
+def test_services_are_served_from_the_catalogue_with_an_etag(api):
+    response = api.get("/api/services", headers={"Accept-Encoding": "identity"})
+    assert response.status_code == 200
+    assert response.headers["Cache-Control"] == server.SERVICES_CACHE_CONTROL
+    assert response.headers["ETag"] == server.service_catalogue.response.etag
+    categories = {category["id"]: category for category in response.json()["categories"]}
+    assert categories.keys() == server.service_catalogue.categories.keys()
+    eyebrow = next(service for service in categories["threading"]["services"] if service["name"] == "Eye Brow")
+    assert eyebrow["price_label"] == "£5"
+
+    revalidated = api.get("/api/services", headers={"If-None-Match": response.headers["ETag"]})
+    assert revalidated.status_code == 304
+    assert revalidated.content == b""
+    assert revalidated.headers["Cache-Control"] == server.SERVICES_CACHE_CONTROL
+    assert api.get("/api/services", headers={"If-None-Match": '"stale"'}).status_code == 200
+
+
+def test_service_lookup_matches_names_and_aliases(api):
+    body = api.get("/api/services/EYEBROW threading").json()
+    assert body["query"] == "EYEBROW threading"
+    assert [(match["category"], match["name"], match["price"]) for match in body["matches"]] == [("threading", "Eye Brow", 5)]
+    # The same name can be a threading and a waxing service
+    upper_lip = api.get("/api/services/Upper-Lip").json()["matches"]
+    assert [(match["category"], match["price"]) for match in upper_lip] == [("threading", 3), ("face_waxing", 4)]
+
+
+def test_service_lookup_404s_for_unknown_services(api):
+    response = api.get("/api/services/hot stone massage")
+    assert response.status_code == 404
+    assert response.json()["detail"] == "Service not found"